@@ -1,38 +1,179 @@
+import os
+import json
 import base64
 import zstd
 import hashlib
-import boto3
-from flask import Flask, request, jsonify
+from datetime import datetime, timezone
+from flask import Flask, Response, request, jsonify
 from app.extensions import db
 from app.models.EventLog import EventLog
-from sqlalchemy import func
+from app.storage import build_image_url, build_thumbnail_urls, find_thumbnail_sizes, stage_image, stage_image_stream, commit_staged_image, image_uploader, known_images, UPLOAD_PENDING, IMAGE_CONTENT_TYPES, DEFAULT_CONTENT_TYPE
+from app.stats import record_events, get_stats
+from app.repeats import find_repeat, fold_repeat
+from app.devices import find_device_id, get_device_id
+from app.models.Device import device_key
+from app.cache import ResponseCache
+from app.commands import register_commands
+from app.metrics import register_metrics, DECOMPRESS_SECONDS, DB_COMMIT_SECONDS
+from sqlalchemy import tuple_
 
 from config import Config
 web_config = Config()
 
-def upload_image_to_s3( image_data, image_hash ):
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=web_config.S3_ACCESS_KEY,
-        aws_secret_access_key=web_config.S3_SECRET_KEY,
-        region_name=web_config.S3_REGION
-    )
+MAX_BATCH_EVENTS = 500  # Most events accepted by a single /api/log_events request
+ZSTD_MIMETYPE = "application/zstd"  # Raw body upload of the zstd compressed image
+STATS_TZ_OFFSET = getattr(web_config, "STATS_TZ_OFFSET", 8)  # Hours from UTC used to bucket statistics, Singapore by default
+RESPONSE_CACHE_TTL = getattr(web_config, "RESPONSE_CACHE_TTL", 30)  # Seconds a cached /api/get_events response is served, 0 to disable
+RESPONSE_CACHE_SIZE = getattr(web_config, "RESPONSE_CACHE_SIZE", 256)
 
-    s3_client.put_object(
-        Bucket=web_config.S3_BUCKET,
-        Key=f"{image_hash}",
-        Body=image_data,
-        ContentType="image/png"
-    )
+def check_authorization():
+    """ Returns an error response if the request is not authorized, None otherwise. """
+    try:
+        assert "Authorization" in request.headers, "Authorization header is missing"
+        assert request.headers["Authorization"] == web_config.UPLOAD_ACCESS_KEY, "Invalid Authorization key"
+    except Exception as e:
+        return jsonify({"error": str(e)}), 401
+    return None
 
-def build_image_url( image_hash ):
-    return f"https://{web_config.S3_BUCKET}.s3.{web_config.S3_REGION}.amazonaws.com/{image_hash}"
+def validate_event_payload( payload_data, image_stream=None ):
+    """ Raises AssertionError describing the first problem found in an event payload. """
+    assert isinstance(payload_data, dict), "Event must be a JSON object"
+    assert image_stream is not None or "image" in payload_data or "image_hash" in payload_data or payload_data.get("repeat"), "Image data is missing"
+    assert "device_name" in payload_data, "Device name is missing"
+    assert "flagged" in payload_data, "Flagged status is missing"
+    assert isinstance(payload_data["flagged"], bool), "Flagged status must be a boolean"
+    if payload_data.get("image"):
+        assert isinstance(payload_data["image"], str), "Image data must be a string or null"
+    if payload_data.get("image_hash"):
+        assert isinstance(payload_data["image_hash"], str) and len(payload_data["image_hash"]) == 64, "Image hash must be a SHA-256 hex digest"
+    if payload_data.get("content_type") is not None:
+        assert payload_data["content_type"] in IMAGE_CONTENT_TYPES, f"Content type must be one of {', '.join(IMAGE_CONTENT_TYPES)}"
+    if payload_data.get("compressed") is not None:
+        assert isinstance(payload_data["compressed"], bool), "Compressed must be a boolean"
+    if payload_data.get("perceptual_hash") is not None:
+        assert isinstance(payload_data["perceptual_hash"], str) and len(payload_data["perceptual_hash"]) == 16, "Perceptual hash must be 16 hex digits"
+        int(payload_data["perceptual_hash"], 16)
+    if payload_data.get("repeat") is not None:
+        assert isinstance(payload_data["repeat"], bool), "Repeat must be a boolean"
+        assert not payload_data["repeat"] or payload_data.get("perceptual_hash"), "Repeats need a perceptual hash"
+    assert isinstance(payload_data["device_name"], str), "Device name must be a string"
+    assert len(payload_data["device_name"].strip()) > 0, "Device name cannot be empty"
+    if payload_data.get("created_at") is not None:
+        created_at = payload_data["created_at"]
+        assert isinstance(created_at, (int, float)) and not isinstance(created_at, bool), "Created at must be a unix timestamp"
+        # Huge, negative or NaN timestamps cannot be turned into a datetime
+        try:
+            datetime.fromtimestamp(created_at, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise AssertionError("Created at is out of range")
+
+def parse_event_fields( fields ):
+    """ Event payload from form fields or query arguments, used by the binary upload modes. """
+    payload_data = {key: fields[key] for key in ("device_name", "image_hash", "content_type", "perceptual_hash") if key in fields}
+    for key in ("flagged", "repeat"):
+        if key in fields:
+            assert fields[key].lower() in ["true", "false"], f"{key.capitalize()} must be a boolean"
+            payload_data[key] = fields[key].lower() == "true"
+    if fields.get("created_at"):
+        payload_data["created_at"] = float(fields["created_at"])
+    return payload_data
+
+def image_file_stream( payload_data, image_file ):
+    """ Stream of a multipart image part, zstd compressed if sent as application/zstd, otherwise the image itself. """
+    payload_data["compressed"] = image_file.mimetype not in IMAGE_CONTENT_TYPES
+    if not payload_data["compressed"]:
+        payload_data.setdefault("content_type", image_file.mimetype)
+    return image_file.stream
+
+def parse_created_at( payload_data ):
+    """ Device capture time if provided ( never in the future ), otherwise the time of ingest. """
+    now = datetime.now( timezone.utc )
+    if payload_data.get("created_at") is None:
+        return now
+    return min(datetime.fromtimestamp(payload_data["created_at"], timezone.utc), now)
+
+def decode_image( image_data, compressed=True ):
+    """ Reverses the device encoding ( base64 of the image, zstd compressed unless `compressed` is False ), returns the image bytes and their hash. """
+    image_data = base64.b64decode(image_data)
+    if compressed:
+        with DECOMPRESS_SECONDS.labels("base64").time():
+            image_data = zstd.decompress(image_data)
+    return image_data, hashlib.sha256(image_data).hexdigest()
+
+def resolve_event_image( payload_data, batch_images=None, image_stream=None ):
+    """
+        Decode and stage the image of an event, unless the server already holds an image with the same hash.
+        The image comes from `image_stream` ( binary uploads ), the base64 `image` field, or events may carry just the
+        image_hash of an image sent before. Either is zstd compressed unless the event says `compressed` false.
+        Returns ( image_hash, upload_status, needs_upload ), all None / False for events without an image.
+        Raises LookupError for a hash-only event whose image the server does not have.
+    """
+    image_data = temp_path = None
+    if image_stream is not None:
+        # Includes writing the image to the staging directory, the two are interleaved chunk by chunk
+        with DECOMPRESS_SECONDS.labels("stream").time():
+            image_hash, temp_path = stage_image_stream(image_stream, payload_data.get("compressed", True))
+    elif payload_data.get("image"):
+        image_data, image_hash = decode_image(payload_data["image"], payload_data.get("compressed", True))
+    elif payload_data.get("image_hash"):
+        image_hash = payload_data["image_hash"]
+    elif payload_data.get("repeat"):
+        raise LookupError("No recent event to fold this repeat into, resend with image data")
+    else:
+        return None, None, False
+
+    try:
+        # Images earlier in the same batch are not committed yet, so the index cannot see them
+        if batch_images is not None and image_hash in batch_images:
+            return image_hash, batch_images[image_hash], False
+        upload_status = known_images.status(image_hash)
+        needs_upload = upload_status is None
+        if needs_upload:
+            if temp_path:
+                commit_staged_image(temp_path, image_hash)
+                temp_path = None
+            elif image_data:
+                stage_image(image_data, image_hash)
+            else:
+                raise LookupError("Image not found, resend with image data")
+            upload_status = UPLOAD_PENDING
+        if batch_images is not None:
+            batch_images[image_hash] = upload_status
+        return image_hash, upload_status, needs_upload
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+def encode_cursor( event, sort_order ):
+    """ Opaque keyset cursor pointing just past `event`. """
+    cursor = json.dumps([event.created_at.isoformat(), event.id, sort_order])
+    return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("utf-8")
+
+def decode_cursor( cursor ):
+    """ Returns ( created_at, id, sort_order ) from a cursor made by encode_cursor. """
+    created_at, event_id, sort_order = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    return datetime.fromisoformat(created_at), int(event_id), sort_order
 
 def create_app():
     flask_app = Flask(__name__)
     flask_app.config["SQLALCHEMY_DATABASE_URI"] = web_config.SQLALCHEMY_DATABASE_URI
 
     db.init_app( flask_app )
+    image_uploader.init_app( flask_app )
+    register_commands( flask_app )
+    register_metrics( flask_app )
+    events_cache = ResponseCache( RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL )
+    # Background workers drop cached pages their updates show up in
+    flask_app.extensions["events_cache"] = events_cache
+
+    def events_response( body, etag ):
+        """ Serialized events page, or 304 if the client already has this version. """
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        return response
 
     @flask_app.route("/api/get_events", methods=["GET"])
     def get_events():
@@ -44,17 +185,30 @@ def create_app():
                 - per_page: Number of events per page (optional) = [1-100].
                 - sort_order: Sort order for events (optional) = asc/desc.
                 - page: Page number for pagination (optional) = [1-∞].
+                - cursor: Fetch the page after this cursor (optional) = [next_cursor of the previous page].
+                  Pass an empty cursor to fetch the first page in cursor mode.
+                - include_total: Count the matching events (optional) = true/false, defaults to true for page
+                  mode and false for cursor mode.
+            Page mode runs an OFFSET scan that gets slower on deep pages, cursor mode seeks on
+            ( created_at, id ) and costs the same on every page, use it for large tables.
             Returns:
-                - events: List of event objects with details.
-                - total_pages: Total number of pages available with the current filter.
-                - current_page: Current page number.
+                - events: List of event objects with details. image_url points at the full image, thumbnail_urls maps
+                  each thumbnail size ( longest edge in pixels ) to its URL, null until the thumbnails are created.
+                - total_pages: Total number of pages available with the current filter ( null if not counted ).
+                - total_events: Total number of events matching the current filter ( null if not counted ).
+                - current_page: Current page number ( page mode only ).
                 - has_next_page: Boolean indicating if there is a next page.
+                - next_cursor: Cursor of the next page, null on the last page ( cursor mode only ).
+            Responses are cached until a matching event is logged ( or RESPONSE_CACHE_TTL passes ) and carry an ETag,
+            send it back as If-None-Match to get a 304 when the page has not changed.
         """
         target_device_name = request.args.get("device_name", None)
         only_flagged = request.args.get("only_flagged", False, bool)
         per_page = request.args.get("per_page", 10, int)
         sort_order = request.args.get("sort_order", "desc")
         page = max( request.args.get("page", 1, int), 1 )
+        cursor = request.args.get("cursor", None)
+        include_total = request.args.get("include_total", "false" if cursor is not None else "true").lower() == "true"
         
         try:
             assert sort_order in ["asc", "desc"], "Invalid sort order"
@@ -62,19 +216,59 @@ def create_app():
             assert per_page <= 100, "per_page value exceeds limit of 100"
             assert isinstance(page, int) and page > 0, "Invalid page value"
             assert target_device_name is None or isinstance(target_device_name, str), "Invalid device name"
+            cursor_key = None
+            if cursor:
+                try:
+                    cursor_created_at, cursor_id, cursor_sort_order = decode_cursor(cursor)
+                except Exception:
+                    raise AssertionError("Invalid cursor")
+                assert cursor_sort_order == sort_order, "Cursor was created with a different sort order"
+                cursor_key = tuple_(cursor_created_at, cursor_id)
         except Exception as e:
             return jsonify({"error": str(e)}), 400
+
+        cache_device_key = device_key(target_device_name) if target_device_name else None
+        cache_key = (cache_device_key, only_flagged, per_page, sort_order, page, cursor, include_total)
+        cached = events_cache.get(cache_key)
+        if cached:
+            return events_response(*cached)
+        cache_generation = events_cache.generation
         
         event_query = EventLog.query
         if only_flagged:
             event_query = event_query.filter(EventLog.flagged == True)
         if target_device_name:
-            event_query = event_query.filter(func.lower(EventLog.device_name) == func.lower(target_device_name))
-        event_query = event_query.order_by(EventLog.created_at.desc() if sort_order == "desc" else EventLog.created_at.asc())
-        event_query = event_query.paginate(page=page, per_page=per_page, error_out=False)
+            # Resolved once to an id so the filter is served by the ( device_id, flagged, created_at ) indexes
+            event_query = event_query.filter(EventLog.device_id == (find_device_id(target_device_name) or 0))
+        if sort_order == "desc":
+            event_query = event_query.order_by(EventLog.created_at.desc(), EventLog.id.desc())
+        else:
+            event_query = event_query.order_by(EventLog.created_at.asc(), EventLog.id.asc())
 
+        total_events = event_query.order_by(None).count() if include_total else None
+        event_key = tuple_(EventLog.created_at, EventLog.id)
+        if cursor_key is not None:
+            event_query = event_query.filter(event_key < cursor_key if sort_order == "desc" else event_key > cursor_key)
+        elif cursor is None:
+            event_query = event_query.offset((page - 1) * per_page)
+        # One extra row tells whether there is a next page without counting
+        events = event_query.limit(per_page + 1).all()
+        has_next_page = len(events) > per_page
+        events = events[:per_page]
+        if cursor is not None:
+            pagination = {
+                "next_cursor": encode_cursor(events[-1], sort_order) if has_next_page else None,
+                "has_next_page": has_next_page
+            }
+        else:
+            pagination = {
+                "current_page": page,
+                "has_next_page": has_next_page
+            }
+
+        thumbnail_sizes = find_thumbnail_sizes({event.image_hash for event in events if event.image_hash})
         event_list = []
-        for event in event_query.items:
+        for event in events:
             event : EventLog = event
             event_dict = {
                 "id": event.id,
@@ -82,58 +276,248 @@ def create_app():
                 "image_hash": event.image_hash,
                 "flagged": event.flagged,
                 "device_name": event.device_name,
-                "image_url": build_image_url(event.image_hash) if event.image_hash else None
+                "content_type": (event.content_type or DEFAULT_CONTENT_TYPE) if event.image_hash else None,
+                "repeat_count": event.repeat_count or 0,
+                "last_seen_at": event.last_seen_at.timestamp() if event.last_seen_at else None,
+                "image_url": build_image_url(event.image_hash) if event.image_hash else None,
+                "thumbnail_urls": build_thumbnail_urls(event.image_hash, thumbnail_sizes.get(event.image_hash))
             }
             event_list.append(event_dict)
-        return jsonify({
+        body = jsonify({
             "events": event_list,
-            "total_pages": event_query.pages,
-            "current_page": page,
-            "has_next_page": event_query.has_next
-        })
+            "total_pages": -(-total_events // per_page) if total_events is not None else None,
+            "total_events": total_events,
+            **pagination
+        }).get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        events_cache.put(cache_key, body, etag, cache_device_key, only_flagged, cache_generation)
+        return events_response(body, etag)
+
+    @flask_app.route("/api/cache_stats", methods=["GET"])
+    def cache_stats():
+        """ Hit rate and size of the /api/get_events response cache in this process. """
+        return jsonify(events_cache.stats())
+
+    @flask_app.route("/api/stats", methods=["GET"])
+    def stats():
+        """
+            Compliance statistics, read from the hourly rollups instead of scanning event_log.
+            Query parameters:
+                - device_name: Only count events from this device ( case insensitive ) (optional) = [Device Name].
+                - days: Number of days in the trend (optional) = [1-366].
+                - tz_offset: Hours from UTC used for "today", hours and days (optional) = [-12-14].
+            Returns:
+                - total_events: Number of events logged.
+                - total_violations: Number of flagged events.
+                - today_violations: Number of flagged events today.
+                - compliance_rate: Percentage of events that were not flagged.
+                - hourly_distribution: Events and violations per hour of the day.
+                - trend: Events and violations per day over the last `days` days.
+        """
+        target_device_name = request.args.get("device_name", None)
+        days = request.args.get("days", 7, int)
+        tz_offset = request.args.get("tz_offset", STATS_TZ_OFFSET, int)
+
+        try:
+            assert isinstance(days, int) and 0 < days <= 366, "Invalid days value"
+            assert isinstance(tz_offset, int) and -12 <= tz_offset <= 14, "Invalid tz_offset value"
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+        device_id = None
+        if target_device_name:
+            # Ids start at 1, so an unknown device counts nothing
+            device_id = find_device_id(target_device_name) or 0
+        return jsonify(get_stats(device_id, days, tz_offset))
 
     @flask_app.route("/api/log_event", methods=["POST"])
     def log_event():
+        """
+            Log a single event.
+            The image can be sent three ways:
+                - application/json: fields below in the body, image base64 encoded ( older devices ).
+                - application/zstd: the compressed image as the raw body, other fields as query arguments.
+                - image/png, image/jpeg or image/webp: the uncompressed image as the raw body, other fields as query arguments.
+                - multipart/form-data: the image as the `image` file, other fields as form fields. The file is zstd compressed
+                  if its content type is application/zstd, otherwise it is the image itself.
+            Binary uploads are decompressed as they stream in, without buffering the whole image.
+            Body:
+                - image: base64 of the zstd compressed evidence image, or null.
+                - compressed: Whether image is zstd compressed (optional) = true/false, defaults to true.
+                - content_type: Format of the image (optional) = image/png / image/jpeg / image/webp, defaults to image/png.
+                - image_hash: SHA-256 of an image sent before, in place of image (optional).
+                  Answered with 409 and image_required if the server does not hold that image.
+                - flagged: Whether the event is a violation = true/false.
+                - device_name: Name of the reporting device.
+                - created_at: Unix timestamp of the capture (optional), defaults to the time of ingest.
+                - perceptual_hash: 64-bit dHash of the image as 16 hex digits (optional). An event within REPEAT_WINDOW
+                  of a recent event from the same device, with the same flagged status and a hash at most REPEAT_MAX_DISTANCE
+                  bits away, is folded into that event's repeat_count instead of being stored.
+                - repeat: The device expects the event to be folded and left the image out (optional) = true/false.
+                  Answered with 409 and image_required if there is no event to fold it into.
+            Returns:
+                - event_id: Id of the new event, or of the event it was folded into.
+                - image_hash: Hash of the stored image, can be sent in place of the image from now on.
+                - repeat_count: Repeats folded into the event so far, only for folded events.
+        """
+        auth_error = check_authorization()
+        if auth_error:
+            return auth_error
+        
+        image_stream = None
         try:
-            assert "Authorization" in request.headers, "Authorization header is missing"
-            assert request.headers["Authorization"] == web_config.UPLOAD_ACCESS_KEY, "Invalid Authorization key"
+            if request.mimetype == ZSTD_MIMETYPE:
+                payload_data = parse_event_fields(request.args)
+                image_stream = request.stream
+            elif request.mimetype in IMAGE_CONTENT_TYPES:
+                payload_data = parse_event_fields(request.args)
+                payload_data.update(content_type=request.mimetype, compressed=False)
+                image_stream = request.stream
+            elif request.mimetype == "multipart/form-data":
+                payload_data = parse_event_fields(request.form)
+                if "image" in request.files:
+                    image_stream = image_file_stream(payload_data, request.files["image"])
+                else:
+                    payload_data.setdefault("image", None)
+            else:
+                assert request.is_json, "Request body must be JSON"
+                payload_data = request.get_json()
+            validate_event_payload(payload_data, image_stream)
         except Exception as e:
-            return jsonify({"error": str(e)}), 401
+            return jsonify({"error": str(e)}), 400
+
+        created_at = parse_created_at(payload_data)
+        device_id = get_device_id(payload_data["device_name"])
+        # Near-duplicates are only counted, nothing is staged, stored or added to the rollups
+        repeated = find_repeat(payload_data.get("perceptual_hash"), device_id, payload_data["flagged"], created_at)
+        if repeated is not None:
+            fold_repeat(repeated, created_at)
+            with DB_COMMIT_SECONDS.labels("log_event").time():
+                db.session.commit()
+            events_cache.invalidate(device_key(repeated.device_name), repeated.flagged)
+            return jsonify({
+                "message": "Event folded into a recent repeat",
+                "event_id": repeated.id,
+                "image_hash": repeated.image_hash,
+                "repeat_count": repeated.repeat_count
+            }), 200
         
         try:
-            assert request.is_json, "Request body must be JSON"
-            payload_data = request.get_json()
-            assert "image" in payload_data, "Image data is missing"
-            assert "device_name" in payload_data, "Device name is missing"
-            assert "flagged" in payload_data, "Flagged status is missing"
-            assert isinstance(payload_data["flagged"], bool), "Flagged status must be a boolean"
-            if payload_data["image"]:
-                assert isinstance(payload_data["image"], str), "Image data must be a string or null"
-            assert isinstance(payload_data["device_name"], str), "Device name must be a string"
-            assert len(payload_data["device_name"]) > 0, "Device name cannot be empty"
+            image_hash, upload_status, needs_upload = resolve_event_image(payload_data, image_stream=image_stream)
+        except LookupError as e:
+            return jsonify({"error": str(e), "image_required": True}), 409
+        except OSError as e:
+            return jsonify({"error": str(e)}), 503
         except Exception as e:
             return jsonify({"error": str(e)}), 400
-        
-        image_hash = None
-        if payload_data["image"]:
-            try:
-                image_data = payload_data["image"]
-                image_data = base64.b64decode(image_data)
-                image_data = zstd.decompress(image_data)
-                image_hash = hashlib.sha256(image_data).hexdigest()
-
-                upload_image_to_s3(image_data, image_hash)
-            except Exception as e:
-                return jsonify({"error": str(e)}), 400
 
+        # Committed right away, the image is uploaded to S3 in the background
         new_event = EventLog(
             image_hash = image_hash,
             flagged = payload_data["flagged"],
-            device_name = payload_data["device_name"]
+            device_name = payload_data["device_name"],
+            created_at = created_at,
+            upload_status = upload_status,
+            device_id = device_id,
+            content_type = (payload_data.get("content_type") or DEFAULT_CONTENT_TYPE) if image_hash else None,
+            perceptual_hash = payload_data.get("perceptual_hash")
         )
         db.session.add(new_event)
-        db.session.commit()
+        record_events([new_event])
+        with DB_COMMIT_SECONDS.labels("log_event").time():
+            db.session.commit()
+        events_cache.invalidate(device_key(new_event.device_name), new_event.flagged)
+        if needs_upload:
+            image_uploader.submit(image_hash, new_event.content_type)
+
+        return jsonify({"message": "Event logged successfully", "event_id": new_event.id, "image_hash": image_hash}), 200
+
+    @flask_app.route("/api/log_events", methods=["POST"])
+    def log_events():
+        """
+            Log many events in one request, for devices catching up after an outage.
+            Either a JSON body, or multipart/form-data with the `events` list as a JSON form field
+            and each compressed image as a file, referenced from its event by `image_file` = [file field name].
+            Body:
+                - events: List of event objects, same format as /api/log_event = [1-MAX_BATCH_EVENTS].
+            Returns:
+                - results: One entry per submitted event, in order. Either {"event_id": id, "image_hash": hash} ( plus
+                  "repeat_count" if the event was folded into a recent one, possibly earlier in the same batch ) or
+                  {"error": message, "retryable": bool, "image_required": bool}. Retryable errors can be resubmitted later,
+                  the others will never be accepted. Images are uploaded to S3 after the response.
+        """
+        auth_error = check_authorization()
+        if auth_error:
+            return auth_error
+
+        try:
+            if request.mimetype == "multipart/form-data":
+                payload_data = {"events": json.loads(request.form.get("events", "null"))}
+            else:
+                assert request.is_json, "Request body must be JSON"
+                payload_data = request.get_json()
+            assert isinstance(payload_data, dict) and isinstance(payload_data.get("events"), list), "Events must be a list"
+            assert 0 < len(payload_data["events"]) <= MAX_BATCH_EVENTS, f"Events must contain 1-{MAX_BATCH_EVENTS} items"
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Each distinct image is staged once, the upload workers push them to S3 concurrently after the commit
+        results = [None] * len(payload_data["events"])
+        batch_images = {}
+        to_upload = {}
+        new_events = {}
+        folded = {}
+        for index, event_data in enumerate(payload_data["events"]):
+            try:
+                image_stream = None
+                if isinstance(event_data, dict) and event_data.get("image_file"):
+                    assert event_data["image_file"] in request.files, f"File {event_data['image_file']} is missing"
+                    image_stream = image_file_stream(event_data, request.files[event_data["image_file"]])
+                validate_event_payload(event_data, image_stream)
+                created_at = parse_created_at(event_data)
+                device_id = get_device_id(event_data["device_name"])
+                repeated = find_repeat(event_data.get("perceptual_hash"), device_id, event_data["flagged"], created_at, new_events.values())
+                if repeated is not None:
+                    fold_repeat(repeated, created_at)
+                    folded[index] = repeated
+                    continue
+                image_hash, upload_status, needs_upload = resolve_event_image(event_data, batch_images, image_stream)
+            except LookupError as e:
+                results[index] = {"error": str(e), "retryable": True, "image_required": True}
+                continue
+            except OSError as e:
+                results[index] = {"error": str(e), "retryable": True}
+                continue
+            except Exception as e:
+                results[index] = {"error": str(e), "retryable": False}
+                continue
+            if needs_upload:
+                to_upload[image_hash] = event_data.get("content_type") or DEFAULT_CONTENT_TYPE
+            new_events[index] = EventLog(
+                image_hash = image_hash,
+                flagged = event_data["flagged"],
+                device_name = event_data["device_name"],
+                created_at = created_at,
+                upload_status = upload_status,
+                device_id = device_id,
+                content_type = (event_data.get("content_type") or DEFAULT_CONTENT_TYPE) if image_hash else None,
+                perceptual_hash = event_data.get("perceptual_hash")
+            )
+
+        # Flushed as a single multi-row INSERT ... RETURNING in one transaction
+        db.session.add_all(new_events.values())
+        record_events(new_events.values())
+        with DB_COMMIT_SECONDS.labels("log_events").time():
+            db.session.commit()
+        for event in [*new_events.values(), *folded.values()]:
+            events_cache.invalidate(device_key(event.device_name), event.flagged)
+        for index, new_event in new_events.items():
+            results[index] = {"event_id": new_event.id, "image_hash": new_event.image_hash}
+        for index, repeated in folded.items():
+            results[index] = {"event_id": repeated.id, "image_hash": repeated.image_hash, "repeat_count": repeated.repeat_count}
+        for image_hash, content_type in to_upload.items():
+            image_uploader.submit(image_hash, content_type)
 
-        return jsonify({"message": "Event logged successfully", "event_id": new_event.id}), 200
+        return jsonify({"results": results}), 200
 
     return flask_app
\ No newline at end of file
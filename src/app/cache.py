@@ -0,0 +1,74 @@
+import time
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+        In-process TTL + LRU cache of serialized responses.
+        Every entry is tagged with the device key it is filtered by ( None for all devices ) and whether it
+        only holds flagged events, so a new event only invalidates the entries it could appear in.
+        Each process has its own cache, the TTL bounds how stale another worker's entries can get.
+    """
+    def __init__( self, max_size=256, ttl=30 ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get( self, key ):
+        """ Returns ( body, etag ) or None. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["body"], entry["etag"]
+
+    def put( self, key, body, etag, device_key, only_flagged, generation ):
+        """ Store a response computed when the cache was at `generation`, dropped if it was invalidated since. """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = {
+                "body": body,
+                "etag": etag,
+                "device_key": device_key,
+                "only_flagged": only_flagged,
+                "expires_at": time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate( self, device_key, flagged ):
+        """ Drop every entry a new event from `device_key` could appear in. """
+        with self._lock:
+            self.generation += 1
+            stale_keys = [
+                key for key, entry in self._entries.items()
+                if entry["device_key"] in (None, device_key) and (flagged or not entry["only_flagged"])
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+            self.invalidations += len(stale_keys)
+
+    def stats( self ):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,71 @@
+import click
+from sqlalchemy import inspect, text
+from app.extensions import db
+from app.storage import image_uploader, backfill_thumbnails, UPLOAD_WORKERS
+from app.stats import backfill_rollups
+from app.devices import migrate_devices
+from app.models.EventRollup import EventRollup
+
+def upgrade_schema():
+    """
+        Bring an existing database up to date with the models.
+        Creates missing tables, then adds any columns and indexes introduced since the tables were created.
+        Safe to run repeatedly.
+    """
+    inspector = inspect(db.engine)
+    # Rollups used to be keyed by device name, they are rebuilt by device id below
+    rebuild_rollups = inspector.has_table(EventRollup.__tablename__) and "device_id" not in {
+        column["name"] for column in inspector.get_columns(EventRollup.__tablename__)
+    }
+    if rebuild_rollups:
+        EventRollup.__table__.drop(db.engine)
+        print("Dropped rollups keyed by device name")
+
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_definition = column.type.compile(dialect=db.engine.dialect)
+            for foreign_key in column.foreign_keys:
+                column_definition += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_definition}"))
+            print(f"Added column {table.name}.{column.name}")
+        db.session.commit()
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    linked = migrate_devices()
+    if linked:
+        print(f"Linked {linked} events to their device")
+    if rebuild_rollups:
+        print(f"Rollups rebuilt from {backfill_rollups()} events")
+
+def register_commands( flask_app ):
+    @flask_app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """ Create missing tables, columns and indexes, then migrate existing rows. """
+        upgrade_schema()
+        click.echo("Database is up to date.")
+
+    @flask_app.cli.command("backfill-rollups")
+    def backfill_rollups_command():
+        """ Rebuild the statistics rollups from every logged event. Pause ingest while this runs. """
+        event_count = backfill_rollups()
+        click.echo(f"Rollups rebuilt from {event_count} events.")
+
+    @flask_app.cli.command("reconcile-uploads")
+    def reconcile_uploads_command():
+        """ Retry failed and lost S3 uploads, then wait for them to finish. """
+        resubmitted = image_uploader.reconcile()
+        image_uploader.executor.shutdown(wait=True)
+        click.echo(f"Resubmitted {resubmitted} uploads.")
+
+    @flask_app.cli.command("backfill-thumbnails")
+    @click.option("--workers", default=UPLOAD_WORKERS, show_default=True, help="Images processed concurrently.")
+    def backfill_thumbnails_command( workers ):
+        """ Create the configured thumbnail sizes for every stored image that lacks them. Safe to rerun. """
+        done, failed = backfill_thumbnails(workers)
+        click.echo(f"Thumbnails created for {done} images, {failed} failed.")
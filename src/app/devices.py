@@ -0,0 +1,65 @@
+import threading
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db, dialect_insert
+from app.models.Device import Device, device_key
+from app.models.EventLog import EventLog
+
+_device_ids = {}
+_device_ids_lock = threading.Lock()
+
+def find_device_id( device_name ):
+    """ Id of the device with this name ( case insensitive ), None if it never logged an event. """
+    key = device_key( device_name )
+    with _device_ids_lock:
+        if key in _device_ids:
+            return _device_ids[key]
+    device_id = db.session.query(Device.id).filter(Device.key == key).scalar()
+    if device_id is not None:
+        with _device_ids_lock:
+            _device_ids[key] = device_id
+    return device_id
+
+def get_device_id( device_name ):
+    """ Id of the device with this name, registering it on first sight. Runs in the current transaction. """
+    device_id = find_device_id( device_name )
+    if device_id is not None:
+        return device_id
+
+    statement = dialect_insert(Device)
+    if statement is not None:
+        db.session.execute(
+            statement.values(key=device_key(device_name), name=device_name).on_conflict_do_nothing(index_elements=[Device.key])
+        )
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Device(device_name))
+        except IntegrityError:
+            # Registered by a concurrent request, the savepoint rolled back and its id is selected below
+            pass
+    # Not cached until committed, the transaction may still roll back
+    return db.session.query(Device.id).filter(Device.key == device_key(device_name)).scalar()
+
+def migrate_devices( chunk_size=10000 ):
+    """
+        Register every device name found in event_log and link events without a device_id, chunk by chunk.
+        Returns the number of events linked.
+    """
+    device_names = db.session.query(EventLog.device_name).filter(EventLog.device_id.is_(None)).distinct().all()
+    for (device_name,) in device_names:
+        get_device_id(device_name)
+    db.session.commit()
+
+    linked = 0
+    max_id = db.session.query(func.max(EventLog.id)).scalar() or 0
+    for start_id in range(0, max_id + 1, chunk_size):
+        result = db.session.execute(
+            update(EventLog)
+            .where(EventLog.device_id.is_(None), EventLog.id >= start_id, EventLog.id < start_id + chunk_size)
+            .values(device_id=select(Device.id).where(Device.key == func.lower(func.trim(EventLog.device_name))).scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        linked += result.rowcount
+    return linked
@@ -0,0 +1,40 @@
+import os
+import time
+from flask import Response, request, g
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# Prometheus metrics of the hot paths, served on /metrics.
+# Under a multi-process server ( e.g. gunicorn workers ) set PROMETHEUS_MULTIPROC_DIR so every worker is aggregated.
+
+REQUEST_SECONDS = Histogram("ppe_http_request_seconds", "Request latency per route", ["route", "method", "status"])
+DECOMPRESS_SECONDS = Histogram("ppe_image_decompress_seconds", "Time to decompress an uploaded image", ["source"])
+S3_PUT_SECONDS = Histogram("ppe_s3_put_seconds", "Time to put an image into S3", ["source"])
+THUMBNAIL_SECONDS = Histogram("ppe_thumbnail_seconds", "Time to create and store the thumbnails of an image", ["source"])
+S3_PUT_FAILURES = Counter("ppe_s3_put_failures_total", "S3 uploads that failed and were left for reconciliation")
+DB_COMMIT_SECONDS = Histogram("ppe_db_commit_seconds", "Time to commit a database transaction", ["operation"])
+
+def metrics_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def register_metrics( flask_app ):
+    @flask_app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @flask_app.after_request
+    def observe_request( response ):
+        if "request_started" in g:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(
+                time.perf_counter() - g.request_started
+            )
+        return response
+
+    @flask_app.route("/metrics", methods=["GET"])
+    def metrics():
+        """ Prometheus text exposition of the server metrics. """
+        return Response(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,16 @@
+from app.extensions import db
+
+class Device( db.Model ):
+    id = db.Column( db.Integer, primary_key=True, autoincrement=True )
+    key = db.Column( db.Text, nullable=False, unique=True )  # Canonical lower-cased name, used for lookups
+    name = db.Column( db.Text, nullable=False )  # Name as first reported by the device
+
+    def __init__( self, name: str ):
+        self.name = name
+        self.key = device_key( name )
+
+    def __repr__( self ):
+        return f"<Device {self.id} {self.key}>"
+
+def device_key( device_name: str ) -> str:
+    return device_name.strip().lower()
@@ -2,22 +2,45 @@ from app.extensions import db
 from datetime import datetime, timezone
 
 class EventLog( db.Model ):
+    __table_args__ = (
+        # Keyset pagination seeks on ( created_at, id ), optionally within one device and flagged status
+        db.Index( "ix_event_log_created_at_id", "created_at", "id" ),
+        db.Index( "ix_event_log_device_flagged_created_at", "device_id", "flagged", "created_at", "id" ),
+        db.Index( "ix_event_log_device_created_at", "device_id", "created_at", "id" ),
+    )
+
     id = db.Column( db.BigInteger, primary_key=True, autoincrement=True )
     created_at = db.Column( db.DateTime, nullable=False, index=True )
-    image_hash = db.Column( db.String( 512 ), nullable=True )
+    image_hash = db.Column( db.String( 512 ), nullable=True, index=True )
     flagged = db.Column( db.Boolean, nullable=False, default=False, index=True )
     device_name = db.Column( db.Text, nullable=False )
+    device_id = db.Column( db.Integer, db.ForeignKey( "device.id" ), nullable=True )  # Null only for events not migrated yet
+    upload_status = db.Column( db.String( 16 ), nullable=True, index=True )  # pending / uploaded / failed, null if no image
+    thumbnail_sizes = db.Column( db.String( 64 ), nullable=True )  # Comma separated sizes of the image's thumbnails, null until they are created
+    perceptual_hash = db.Column( db.String( 16 ), nullable=True )  # dHash of the image, hex, for folding near-duplicate events
+    repeat_count = db.Column( db.Integer, nullable=True )  # Near-duplicate events folded into this one, null for none
+    last_seen_at = db.Column( db.DateTime, nullable=True )  # Time of the latest folded repeat
+    content_type = db.Column( db.String( 32 ), nullable=True )  # Of the image, null for events logged before devices could send JPEG / WebP ( PNG )
 
     def __init__(
         self,
         image_hash: str,
         flagged: bool = False,
-        device_name: str = None
+        device_name: str = None,
+        created_at: datetime = None,
+        upload_status: str = None,
+        device_id: int = None,
+        content_type: str = None,
+        perceptual_hash: str = None
     ):
         self.image_hash = image_hash
         self.flagged = flagged
         self.device_name = device_name
-        self.created_at = datetime.now( timezone.utc )
+        self.device_id = device_id
+        self.created_at = created_at or datetime.now( timezone.utc )
+        self.upload_status = upload_status
+        self.content_type = content_type
+        self.perceptual_hash = perceptual_hash
 
     def __repr__( self ):
         return f"<EventLog {self.id}>"
\ No newline at end of file
@@ -0,0 +1,11 @@
+from app.extensions import db
+
+class EventRollup( db.Model ):
+    """ Per-device, per-hour event counts, kept up to date with every logged event. """
+    device_id = db.Column( db.Integer, db.ForeignKey( "device.id" ), primary_key=True )
+    hour = db.Column( db.DateTime, primary_key=True, index=True )  # Start of the hour, UTC
+    total = db.Column( db.BigInteger, nullable=False, default=0 )
+    flagged = db.Column( db.BigInteger, nullable=False, default=0 )
+
+    def __repr__( self ):
+        return f"<EventRollup {self.device_id} {self.hour}>"
@@ -0,0 +1,80 @@
+from datetime import timedelta, timezone
+from sqlalchemy import case, func, update
+from app.extensions import db
+from app.models.EventLog import EventLog
+
+from config import Config
+web_config = Config()
+
+# Near-duplicate events: a worker who lingers at the gate or re-triggers the sensor sends a string of almost identical
+# captures. Devices send a perceptual hash ( 64-bit dHash ) of each evidence image; an event whose hash is within
+# REPEAT_MAX_DISTANCE bits of a recent event from the same device, with the same flagged status, is folded into that
+# event's repeat_count instead of being stored again.
+
+REPEAT_WINDOW = getattr(web_config, "REPEAT_WINDOW", 120)  # Seconds after an event's last sighting that repeats are folded into it, 0 to disable
+REPEAT_MAX_DISTANCE = getattr(web_config, "REPEAT_MAX_DISTANCE", 6)  # Most differing bits between the perceptual hashes of a repeat
+REPEAT_CANDIDATES = 20  # Most recent events of the device compared against
+
+def hamming( perceptual_hash, other_hash ):
+    return bin(int(perceptual_hash, 16) ^ int(other_hash, 16)).count("1")
+
+def naive_utc( moment ):
+    """ Stored datetimes are naive UTC. """
+    if moment.tzinfo is not None:
+        moment = moment.astimezone( timezone.utc ).replace( tzinfo=None )
+    return moment
+
+def last_seen( event ):
+    return naive_utc( event.last_seen_at or event.created_at )
+
+def is_repeat_of( event, perceptual_hash, flagged, created_at ):
+    window = timedelta(seconds=REPEAT_WINDOW)
+    return (
+        event.perceptual_hash is not None
+        and event.flagged == flagged
+        and naive_utc( event.created_at ) - window <= created_at <= last_seen( event ) + window
+        and hamming(event.perceptual_hash, perceptual_hash) <= REPEAT_MAX_DISTANCE
+    )
+
+def find_repeat( perceptual_hash, device_id, flagged, created_at, pending_events=() ):
+    """
+        The event `perceptual_hash` repeats, None if there is none or folding is disabled.
+        `pending_events` are events added in the current transaction ( earlier in the same batch ), which are checked first.
+    """
+    if not REPEAT_WINDOW or not perceptual_hash or device_id is None:
+        return None
+    created_at = naive_utc( created_at )
+    for event in reversed(list(pending_events)):
+        if event.device_id == device_id and is_repeat_of( event, perceptual_hash, flagged, created_at ):
+            return event
+    # Served by the ( device_id, flagged, created_at ) index, the pending batch is not flushed for it
+    with db.session.no_autoflush:
+        candidates = EventLog.query.filter(
+            EventLog.device_id == device_id,
+            EventLog.flagged == flagged,
+            EventLog.created_at <= created_at + timedelta(seconds=REPEAT_WINDOW),
+            EventLog.perceptual_hash.isnot(None)
+        ).order_by(EventLog.created_at.desc(), EventLog.id.desc()).limit(REPEAT_CANDIDATES).all()
+    for event in candidates:
+        if is_repeat_of( event, perceptual_hash, flagged, created_at ):
+            return event
+    return None
+
+def fold_repeat( event, created_at ):
+    """
+        Count another sighting of `event`, in the current transaction. Stored events are updated in SQL so concurrent
+        ingests cannot lose a count, events not flushed yet ( earlier in the same batch ) are only visible to us.
+    """
+    created_at = naive_utc( created_at )
+    if event.id is None:
+        event.repeat_count = ( event.repeat_count or 0 ) + 1
+        event.last_seen_at = max( last_seen( event ), created_at )
+        return
+    seen = func.coalesce(EventLog.last_seen_at, EventLog.created_at)
+    db.session.execute(
+        update(EventLog).where(EventLog.id == event.id).values(
+            repeat_count = func.coalesce(EventLog.repeat_count, 0) + 1,
+            last_seen_at = case((seen > created_at, seen), else_=created_at)
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.expire(event, ["repeat_count", "last_seen_at"])
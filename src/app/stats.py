@@ -0,0 +1,118 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from app.extensions import db, dialect_insert
+from app.models.EventLog import EventLog
+from app.models.EventRollup import EventRollup
+
+def hour_bucket( created_at ):
+    """ Start of the hour containing `created_at`, as a naive UTC datetime ( naive input is taken as UTC ). """
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone( timezone.utc ).replace( tzinfo=None )
+    return created_at.replace( minute=0, second=0, microsecond=0 )
+
+def upsert_rollups( counts ):
+    """ Add {( device_id, hour ): ( total, flagged )} to the rollups, in the current transaction. """
+    if not counts:
+        return
+    rows = [
+        {"device_id": device_id, "hour": hour, "total": total, "flagged": flagged}
+        for ( device_id, hour ), ( total, flagged ) in counts.items()
+    ]
+    statement = dialect_insert(EventRollup)
+    if statement is not None:
+        statement = statement.values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[EventRollup.device_id, EventRollup.hour],
+            set_={
+                "total": EventRollup.total + statement.excluded.total,
+                "flagged": EventRollup.flagged + statement.excluded.flagged
+            }
+        )
+        db.session.execute(statement)
+        return
+
+    for row in rows:
+        rollup = db.session.get(EventRollup, (row["device_id"], row["hour"]), with_for_update=True)
+        if rollup is None:
+            db.session.add(EventRollup(**row))
+        else:
+            rollup.total += row["total"]
+            rollup.flagged += row["flagged"]
+
+def record_events( events ):
+    """ Count newly added events into the rollups, call before the commit that adds them. """
+    counts = Counter()
+    flagged_counts = Counter()
+    for event in events:
+        key = (event.device_id, hour_bucket(event.created_at))
+        counts[key] += 1
+        flagged_counts[key] += 1 if event.flagged else 0
+    upsert_rollups({key: (counts[key], flagged_counts[key]) for key in counts})
+
+def backfill_rollups( chunk_size=10000 ):
+    """ Rebuild every rollup from event_log. Returns the number of events counted. """
+    counts = Counter()
+    flagged_counts = Counter()
+    event_count = 0
+    rows = db.session.query(EventLog.device_id, EventLog.created_at, EventLog.flagged).filter(
+        EventLog.device_id.isnot(None)
+    ).yield_per(chunk_size)
+    for device_id, created_at, flagged in rows:
+        key = (device_id, hour_bucket(created_at))
+        counts[key] += 1
+        flagged_counts[key] += 1 if flagged else 0
+        event_count += 1
+
+    EventRollup.query.delete()
+    upsert_rollups({key: (counts[key], flagged_counts[key]) for key in counts})
+    db.session.commit()
+    return event_count
+
+def get_stats( device_id=None, days=7, tz_offset=0 ):
+    """
+        Compliance statistics read only from the rollups.
+        `tz_offset` ( whole hours from UTC ) sets which hours count as "today" and how hours and days are bucketed.
+    """
+    offset = timedelta(hours=tz_offset)
+    rollup_query = db.session.query(
+        EventRollup.hour,
+        func.sum(EventRollup.total),
+        func.sum(EventRollup.flagged)
+    )
+    if device_id is not None:
+        rollup_query = rollup_query.filter(EventRollup.device_id == device_id)
+    hourly_rows = rollup_query.group_by(EventRollup.hour).all()
+
+    local_today = (datetime.now( timezone.utc ).replace( tzinfo=None ) + offset).date()
+    first_trend_day = local_today - timedelta(days=days - 1)
+    total_events = total_violations = today_violations = 0
+    hourly_distribution = [{"hour": hour, "total": 0, "violations": 0} for hour in range(24)]
+    trend = {
+        first_trend_day + timedelta(days=day): {"total": 0, "violations": 0}
+        for day in range(days)
+    }
+    for hour, total, flagged in hourly_rows:
+        total, flagged = int(total), int(flagged)
+        local_hour = hour + offset
+        total_events += total
+        total_violations += flagged
+        if local_hour.date() == local_today:
+            today_violations += flagged
+        hourly_distribution[local_hour.hour]["total"] += total
+        hourly_distribution[local_hour.hour]["violations"] += flagged
+        if local_hour.date() in trend:
+            trend[local_hour.date()]["total"] += total
+            trend[local_hour.date()]["violations"] += flagged
+
+    return {
+        "total_events": total_events,
+        "total_violations": total_violations,
+        "today_violations": today_violations,
+        "compliance_rate": round((total_events - total_violations) / total_events * 100) if total_events else 0,
+        "hourly_distribution": hourly_distribution,
+        "trend": [
+            {"date": day.isoformat(), "total": counts["total"], "violations": counts["violations"]}
+            for day, counts in trend.items()
+        ]
+    }
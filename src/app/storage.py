@@ -0,0 +1,345 @@
+import os
+import hashlib
+import tempfile
+import threading
+import boto3
+import zstandard
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.extensions import db
+from app.models.EventLog import EventLog
+from app.models.Device import device_key
+from app.metrics import S3_PUT_SECONDS, S3_PUT_FAILURES, DB_COMMIT_SECONDS, THUMBNAIL_SECONDS
+from app.thumbnails import THUMBNAIL_SIZES, THUMBNAIL_SPEC, THUMBNAIL_CONTENT_TYPE, thumbnail_key, parse_thumbnail_spec, make_thumbnails
+
+from config import Config
+web_config = Config()
+
+S3_ENDPOINT_URL = getattr(web_config, "S3_ENDPOINT_URL", None)  # Set to a local S3 stand-in ( e.g. MinIO, moto_server ) for testing
+UPLOAD_STAGING_DIR = getattr(web_config, "UPLOAD_STAGING_DIR", "upload-staging")
+UPLOAD_WORKERS = getattr(web_config, "UPLOAD_WORKERS", 8)
+RECONCILE_INTERVAL = getattr(web_config, "RECONCILE_INTERVAL", 300)  # Seconds between retries of failed uploads, 0 to disable
+KNOWN_HASH_CACHE_SIZE = getattr(web_config, "KNOWN_HASH_CACHE_SIZE", 10000)
+STALE_PENDING_AFTER = timedelta(minutes=10)  # Pending uploads older than this are assumed lost ( e.g. process restarted )
+
+UPLOAD_PENDING = "pending"
+UPLOAD_DONE = "uploaded"
+UPLOAD_FAILED = "failed"
+
+IMAGE_CONTENT_TYPES = ["image/png", "image/jpeg", "image/webp"]  # Evidence image formats devices may send
+DEFAULT_CONTENT_TYPE = "image/png"  # Devices that do not say send PNG
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """ One long-lived client shared by every thread, boto3 clients are thread-safe. """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=web_config.S3_ACCESS_KEY,
+                    aws_secret_access_key=web_config.S3_SECRET_KEY,
+                    region_name=web_config.S3_REGION,
+                    endpoint_url=S3_ENDPOINT_URL
+                )
+    return _s3_client
+
+def upload_image_to_s3( image_data, key, content_type=DEFAULT_CONTENT_TYPE ):
+    """ Put an image held in memory, `key` is the image hash for evidence images. """
+    with S3_PUT_SECONDS.labels("bytes").time():
+        get_s3_client().put_object(
+            Bucket=web_config.S3_BUCKET,
+            Key=f"{key}",
+            Body=image_data,
+            ContentType=content_type
+        )
+
+def upload_file_to_s3( path, image_hash, content_type=DEFAULT_CONTENT_TYPE ):
+    """ Streams a file to S3 ( multipart for large files ) without reading it into memory. """
+    with S3_PUT_SECONDS.labels("file").time():
+        get_s3_client().upload_file(
+            path,
+            web_config.S3_BUCKET,
+            f"{image_hash}",
+            ExtraArgs={"ContentType": content_type}
+        )
+
+def build_image_url( key ):
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL}/{web_config.S3_BUCKET}/{key}"
+    return f"https://{web_config.S3_BUCKET}.s3.{web_config.S3_REGION}.amazonaws.com/{key}"
+
+def build_thumbnail_urls( image_hash, spec ):
+    """ { size: url } of the thumbnails listed in `spec`, None if the image has none yet. """
+    if not spec:
+        return None
+    return {str(size): build_image_url(thumbnail_key(image_hash, size)) for size in parse_thumbnail_spec(spec)}
+
+def read_stored_image( image_hash ):
+    """ The full image, from the staging directory while it is still there, from S3 otherwise. """
+    path = staged_image_path(image_hash)
+    if os.path.exists(path):
+        with open(path, "rb") as staged_file:
+            return staged_file.read()
+    return get_s3_client().get_object(Bucket=web_config.S3_BUCKET, Key=f"{image_hash}")["Body"].read()
+
+def store_thumbnails( image_data, image_hash, source ):
+    """
+        Create the configured thumbnails of an image and put them in S3, then record them on its events and
+        drop the cached event pages they appear in.
+    """
+    with THUMBNAIL_SECONDS.labels(source).time():
+        for size, thumbnail in make_thumbnails(image_data).items():
+            upload_image_to_s3(thumbnail, thumbnail_key(image_hash, size), THUMBNAIL_CONTENT_TYPE)
+    events = db.session.query(EventLog.device_name, EventLog.flagged).filter(EventLog.image_hash == image_hash).distinct().all()
+    EventLog.query.filter(EventLog.image_hash == image_hash).update({"thumbnail_sizes": THUMBNAIL_SPEC}, synchronize_session=False)
+    with DB_COMMIT_SECONDS.labels("thumbnails").time():
+        db.session.commit()
+    events_cache = current_app.extensions.get("events_cache")
+    if events_cache is not None:
+        for device_name, flagged in events:
+            events_cache.invalidate(device_key(device_name), flagged)
+
+def find_thumbnail_sizes( image_hashes ):
+    """
+        { image hash: thumbnail spec } of the images that have thumbnails.
+        Looked up by hash, so events logged after the thumbnails were made ( duplicate images ) still find them.
+    """
+    if not image_hashes:
+        return {}
+    rows = db.session.query(EventLog.image_hash, EventLog.thumbnail_sizes).filter(
+        EventLog.image_hash.in_(image_hashes),
+        EventLog.thumbnail_sizes.isnot(None)
+    ).distinct()
+    return {image_hash: spec for image_hash, spec in rows}
+
+def backfill_thumbnails( workers=UPLOAD_WORKERS ):
+    """
+        Create the thumbnails of every stored image without the configured sizes, `workers` images at a time.
+        Returns ( images done, images failed ).
+    """
+    if not THUMBNAIL_SIZES:
+        return 0, 0
+    with_thumbnails = db.session.query(EventLog.image_hash).filter(EventLog.thumbnail_sizes == THUMBNAIL_SPEC)
+    image_hashes = [image_hash for (image_hash,) in db.session.query(EventLog.image_hash).filter(
+        EventLog.image_hash.isnot(None),
+        # Events logged before upload tracking have no status, their images are in S3
+        db.or_(EventLog.upload_status == UPLOAD_DONE, EventLog.upload_status.is_(None)),
+        EventLog.image_hash.notin_(with_thumbnails)
+    ).distinct()]
+    app = current_app._get_current_object()
+
+    def backfill( image_hash ):
+        with app.app_context():
+            try:
+                store_thumbnails(read_stored_image(image_hash), image_hash, "backfill")
+                return True
+            except Exception as e:
+                print(f"Error creating thumbnails of {image_hash}: {e}")
+                db.session.rollback()
+                return False
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail-backfill") as executor:
+        done = sum(executor.map(backfill, image_hashes))
+    return done, len(image_hashes) - done
+
+def staged_image_path( image_hash ):
+    return os.path.join(UPLOAD_STAGING_DIR, image_hash)
+
+def stage_image( image_data, image_hash ):
+    """ Keep the image on local disk until it is in S3, so failed uploads can be retried. """
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    path = staged_image_path(image_hash)
+    if os.path.exists(path):
+        return
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as staged_file:
+        staged_file.write(image_data)
+    os.replace(temp_path, path)
+
+def stage_image_stream( image_stream, compressed=True, chunk_size=64 * 1024 ):
+    """
+        Copy an image stream chunk by chunk straight into a temporary staging file, hashing as it goes.
+        zstd compressed streams are decompressed on the way.
+        Returns the image hash and the temporary path, which the caller either commits or removes.
+    """
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    temp_file = tempfile.NamedTemporaryFile(dir=UPLOAD_STAGING_DIR, suffix=".tmp", delete=False)
+    if compressed:
+        image_stream = zstandard.ZstdDecompressor().stream_reader(image_stream, read_across_frames=True)
+    try:
+        with temp_file:
+            while True:
+                chunk = image_stream.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                temp_file.write(chunk)
+    except Exception:
+        os.remove(temp_file.name)
+        raise
+    return hasher.hexdigest(), temp_file.name
+
+def commit_staged_image( temp_path, image_hash ):
+    os.replace(temp_path, staged_image_path(image_hash))
+
+def set_upload_status( image_hash, status ):
+    EventLog.query.filter(
+        EventLog.image_hash == image_hash,
+        EventLog.upload_status != UPLOAD_DONE
+    ).update({"upload_status": status}, synchronize_session=False)
+    with DB_COMMIT_SECONDS.labels("upload_status").time():
+        db.session.commit()
+    if status == UPLOAD_DONE:
+        known_images.add(image_hash)
+
+class KnownImageIndex:
+    """
+        Which image hashes the server already holds, so duplicate images skip staging and put_object.
+        Confirmed uploads are kept in an in-process LRU, misses fall back to an indexed EventLog.image_hash lookup.
+    """
+    def __init__( self, max_size ):
+        self.max_size = max_size
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add( self, image_hash ):
+        with self._lock:
+            self._hashes[image_hash] = True
+            self._hashes.move_to_end(image_hash)
+            while len(self._hashes) > self.max_size:
+                self._hashes.popitem(last=False)
+
+    def status( self, image_hash ):
+        """ Upload status of a known image ( uploaded or pending ), None if the server does not have it. """
+        with self._lock:
+            if image_hash in self._hashes:
+                self._hashes.move_to_end(image_hash)
+                return UPLOAD_DONE
+        statuses = {
+            status for (status,) in db.session.query(EventLog.upload_status).filter(
+                EventLog.image_hash == image_hash
+            ).distinct()
+        }
+        # Events logged before upload tracking have no status, their images are already in S3
+        if UPLOAD_DONE in statuses or None in statuses:
+            self.add(image_hash)
+            return UPLOAD_DONE
+        if UPLOAD_PENDING in statuses:
+            return UPLOAD_PENDING
+        if UPLOAD_FAILED in statuses and os.path.exists(staged_image_path(image_hash)):
+            return UPLOAD_FAILED
+        return None
+
+known_images = KnownImageIndex(KNOWN_HASH_CACHE_SIZE)
+
+class ImageUploader:
+    """
+        Background S3 upload worker pool.
+        Request handlers stage the image on disk, commit the event as pending and return;
+        the workers upload the staged image and mark every event with that hash as uploaded ( or failed ).
+    """
+    def __init__( self ):
+        self.app = None
+        self.executor = None
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._reconciling = False
+
+    def init_app( self, app ):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+        # Reconciliation starts with the first request, so CLI commands such as upgrade-db never run it
+        if RECONCILE_INTERVAL:
+            app.before_request(self._start_reconcile)
+
+    def _start_reconcile( self ):
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+        threading.Thread(target=self._reconcile_loop, name="s3-reconcile", daemon=True).start()
+
+    def submit( self, image_hash, content_type=None ):
+        with self._lock:
+            if image_hash in self._in_flight:
+                return
+            self._in_flight.add(image_hash)
+        self.executor.submit(self._upload, image_hash, content_type or DEFAULT_CONTENT_TYPE)
+
+    def _upload( self, image_hash, content_type ):
+        with self.app.app_context():
+            try:
+                path = staged_image_path(image_hash)
+                upload_file_to_s3(path, image_hash, content_type)
+                set_upload_status(image_hash, UPLOAD_DONE)
+                if THUMBNAIL_SIZES:
+                    self._thumbnails(path, image_hash)
+                os.remove(path)
+            except Exception as e:
+                print(f"Error uploading image {image_hash}: {e}")
+                S3_PUT_FAILURES.inc()
+                db.session.rollback()
+                set_upload_status(image_hash, UPLOAD_FAILED)
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._in_flight.discard(image_hash)
+
+    def _thumbnails( self, path, image_hash ):
+        """ The full image is already in S3, a failure here only leaves it without thumbnails until the next backfill. """
+        try:
+            with open(path, "rb") as staged_file:
+                store_thumbnails(staged_file.read(), image_hash, "ingest")
+        except Exception as e:
+            print(f"Error creating thumbnails of {image_hash}: {e}")
+            db.session.rollback()
+
+    def reconcile( self ):
+        """ Resubmit failed uploads and pending uploads that were lost. Returns the number of images resubmitted. """
+        stale_before = datetime.now( timezone.utc ) - STALE_PENDING_AFTER
+        rows = db.session.query(EventLog.image_hash, EventLog.content_type).filter(
+            db.or_(
+                EventLog.upload_status == UPLOAD_FAILED,
+                db.and_(EventLog.upload_status == UPLOAD_PENDING, EventLog.created_at < stale_before)
+            )
+        ).distinct().all()
+        resubmitted = 0
+        for image_hash, content_type in rows:
+            if not os.path.exists(staged_image_path(image_hash)):
+                # An event committed as pending just after its image finished uploading is left behind, catch it up
+                uploaded = db.session.query(EventLog.id).filter(
+                    EventLog.image_hash == image_hash,
+                    db.or_(EventLog.upload_status == UPLOAD_DONE, EventLog.upload_status.is_(None))
+                ).first()
+                if uploaded is not None:
+                    set_upload_status(image_hash, UPLOAD_DONE)
+                    continue
+                print(f"Staged image {image_hash} is gone, cannot retry upload")
+                continue
+            self.submit(image_hash, content_type)
+            resubmitted += 1
+        return resubmitted
+
+    def _reconcile_loop( self ):
+        stopped = threading.Event()
+        while not stopped.wait(RECONCILE_INTERVAL):
+            with self.app.app_context():
+                try:
+                    resubmitted = self.reconcile()
+                    if resubmitted:
+                        print(f"Reconciliation resubmitted {resubmitted} uploads")
+                except Exception as e:
+                    print(f"Error reconciling uploads: {e}")
+                finally:
+                    db.session.remove()
+
+image_uploader = ImageUploader()
@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+
+from config import Config
+web_config = Config()
+
+# Thumbnails of the evidence images for list views, stored in S3 next to the full image under derived keys.
+
+THUMBNAIL_SIZES = sorted(getattr(web_config, "THUMBNAIL_SIZES", [160, 480]))  # Longest edge of each thumbnail in pixels, [] to disable
+THUMBNAIL_QUALITY = getattr(web_config, "THUMBNAIL_QUALITY", 80)  # JPEG quality of the thumbnails
+THUMBNAIL_CONTENT_TYPE = "image/jpeg"
+THUMBNAIL_SPEC = ",".join(str(size) for size in THUMBNAIL_SIZES)  # Recorded with the events once their thumbnails exist
+
+def thumbnail_key( image_hash, size ):
+    """ S3 key of a thumbnail, derived from the key of the full image. """
+    return f"thumbnails/{size}/{image_hash}.jpg"
+
+def parse_thumbnail_spec( spec ):
+    """ "160,480" -> [ 160, 480 ] """
+    return [int(size) for size in (spec or "").split(",") if size]
+
+def make_thumbnails( image_data, sizes=THUMBNAIL_SIZES ):
+    """ JPEG thumbnails of an encoded image ( PNG, JPEG or WebP ) by size, never upscaled. """
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert image is not None, "Image cannot be decoded"
+    height, width = image.shape[:2]
+    thumbnails = {}
+    for size in sizes:
+        scale = size / max(height, width)
+        thumbnail = image
+        if scale < 1:
+            thumbnail = cv2.resize(
+                image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA
+            )
+        _, buffer = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        thumbnails[size] = buffer.tobytes()
+    return thumbnails
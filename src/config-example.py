@@ -5,4 +5,21 @@ class Config():
     S3_ACCESS_KEY : str = "S3_ACCESS_KEY"
     S3_SECRET_KEY : str = "S3_SECRET_KEY"
     S3_REGION : str = "ap-southeast-1"
-    S3_BUCKET : str = "ppe-vision-image"
\ No newline at end of file
+    S3_BUCKET : str = "ppe-vision-image"
+    S3_ENDPOINT_URL : str = None  # Optional, point at a local S3 stand-in ( e.g. http://127.0.0.1:9000 for MinIO ) for testing
+
+    UPLOAD_STAGING_DIR : str = "upload-staging"  # Images are kept here until they are in S3
+    UPLOAD_WORKERS : int = 8  # Background S3 upload threads
+    RECONCILE_INTERVAL : int = 300  # Seconds between retries of failed uploads, 0 to disable
+    KNOWN_HASH_CACHE_SIZE : int = 10000  # Image hashes kept in memory to skip duplicate uploads
+
+    STATS_TZ_OFFSET : int = 8  # Hours from UTC used to bucket /api/stats, 8 for Singapore
+
+    RESPONSE_CACHE_TTL : int = 30  # Seconds a cached /api/get_events response may be served, 0 to disable
+    RESPONSE_CACHE_SIZE : int = 256  # Cached /api/get_events responses per process
+
+    THUMBNAIL_SIZES : list = [160, 480]  # Longest edge in pixels of the thumbnails made for list views, [] to disable
+    THUMBNAIL_QUALITY : int = 80  # JPEG quality of the thumbnails
+
+    REPEAT_WINDOW : int = 120  # Seconds after an event was last seen that near-identical events are folded into it, 0 to disable
+    REPEAT_MAX_DISTANCE : int = 6  # Most differing bits between the perceptual hashes of folded events
\ No newline at end of file
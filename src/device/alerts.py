@@ -0,0 +1,147 @@
+import time
+import asyncio
+import threading
+from device.metrics import ALERTS, ALERT_SECONDS
+
+class AlertDispatcher:
+    """
+        Sends Telegram alerts from an asyncio event loop on its own thread, so the gate never waits on the round trip.
+        Alerts go through a bounded queue, when it is full the oldest waiting alert is dropped.
+        Each chat gets at most one message every `min_interval` seconds.
+        Once a device has alerted, its further violations within `coalesce_window` seconds are held back and sent as
+        one summary when the window closes, so a queue of people without helmets does not flood the chat.
+        The encoded evidence image is attached when given, so nobody has to wait for it to reach S3.
+    """
+    def __init__( self, token, chat_ids, max_queue=50, min_interval=1.0, coalesce_window=60 ):
+        self.token = token
+        self.chat_ids = chat_ids
+        self.max_queue = max_queue
+        self.min_interval = min_interval
+        self.coalesce_window = coalesce_window
+        self._bot = None
+        self._queue = None
+        self._devices = {}  # Device name -> { "last_sent", "held", "flush" } of its coalescing window
+        self._next_send = {}  # Chat id -> earliest time its next message may go out
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+
+    def start( self ):
+        self._thread.start()
+
+    def stop( self, timeout=None ):
+        """ Send what is queued or held back, then stop. """
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._enqueue, None)
+            self._thread.join(timeout)
+
+    def alert( self, device_name, text, missing=(), photo=None, captured_at=None ):
+        """ Queue an alert and return right away. `photo` is the encoded image ( JPEG, PNG or WebP bytes ). """
+        print("Sending Alert to Telegram: ", text)
+        if not self.token or not self.chat_ids:
+            return
+        self._loop.call_soon_threadsafe(self._enqueue, {
+            "device_name": device_name,
+            "text": text,
+            "missing": list(missing),
+            "photo": photo,
+            "captured_at": captured_at
+        })
+
+    def _enqueue( self, alert ):
+        if self._queue.full():
+            dropped = self._queue.get_nowait()
+            if dropped is not None:
+                ALERTS.labels("dropped").inc()
+                print(f"Alert queue full, dropped alert from {dropped['device_name']}")
+        self._queue.put_nowait(alert)
+
+    def _run( self ):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._loop.run_until_complete(self._consume())
+        self._loop.close()
+
+    async def _consume( self ):
+        while True:
+            alert = await self._queue.get()
+            if alert is None:
+                break
+            await self._handle(alert)
+        for device_name, device in self._devices.items():
+            if "flush" in device:
+                device["flush"].cancel()
+                await self._flush(device_name)
+        if self._bot is not None:
+            await self._bot.shutdown()
+
+    async def _handle( self, alert ):
+        device = self._devices.setdefault(alert["device_name"], {"last_sent": None, "held": []})
+        now = time.monotonic()
+        if device["last_sent"] is not None and now - device["last_sent"] < self.coalesce_window:
+            device["held"].append(alert)
+            ALERTS.labels("coalesced").inc()
+            if "flush" not in device:
+                device["flush"] = asyncio.ensure_future(
+                    self._flush_later(alert["device_name"], device["last_sent"] + self.coalesce_window - now)
+                )
+            return
+        device["last_sent"] = now
+        await self._send(alert)
+
+    async def _flush_later( self, device_name, delay ):
+        await asyncio.sleep(delay)
+        await self._flush(device_name)
+
+    async def _flush( self, device_name ):
+        """ Send the violations held back during a device's window as one summary, with the newest image. """
+        device = self._devices[device_name]
+        device.pop("flush", None)
+        held, device["held"] = device["held"], []
+        if not held:
+            return
+        device["last_sent"] = time.monotonic()
+        missing = sorted(set().union(*(alert["missing"] for alert in held)))
+        await self._send({
+            **held[-1],
+            "text": f"{len(held)} more PPE violation(s) at {device_name} in the last {self.coalesce_window:.0f}s, "
+                    f"missing: {', '.join(missing)}. Latest: {held[-1]['text']}"
+        })
+
+    async def _send( self, alert ):
+        await asyncio.gather(*(self._send_to(chat_id, alert) for chat_id in self.chat_ids))
+
+    async def _send_to( self, chat_id, alert ):
+        # The slot is taken before sleeping, so concurrent sends to one chat queue up behind each other
+        now = time.monotonic()
+        slot = max(now, self._next_send.get(chat_id, now))
+        self._next_send[chat_id] = slot + self.min_interval
+        await asyncio.sleep(slot - now)
+
+        bot = await self._get_bot()
+        for attempt in range(2):
+            try:
+                if alert["photo"]:
+                    # Captions are limited to 1024 characters
+                    await bot.send_photo(chat_id=chat_id, photo=alert["photo"], caption=alert["text"][:1024])
+                else:
+                    await bot.send_message(chat_id=chat_id, text=alert["text"])
+                ALERTS.labels("sent").inc()
+                if alert["captured_at"]:
+                    ALERT_SECONDS.observe(time.time() - alert["captured_at"])
+                return
+            except Exception as e:
+                # Telegram asks to slow down with RetryAfter, honour it once
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None or attempt:
+                    print(f"Error sending alert to chat {chat_id}: {e}")
+                    break
+                await asyncio.sleep(retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after)
+        ALERTS.labels("failed").inc()
+
+    async def _get_bot( self ):
+        # python-telegram-bot is slow to import and not needed to arm the gate
+        if self._bot is None:
+            from telegram import Bot
+            self._bot = Bot(token=self.token)
+            await self._bot.initialize()
+        return self._bot
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+import cv2
+import numpy as np
+from device.inference import BACKENDS, load_model, list_images
+from device.repeats import dhash
+from device.vision import IMAGE_FORMATS, timed, show_guide, run_inference, encode_image
+
+# Replays recorded frames through the same guide / inference / encode steps as the gate and reports per-step latency.
+# Nothing here touches the camera, the sensor or the network, so results are comparable across commits and hardware.
+
+STEPS = ["guide", "crop_resize", "forward", "postprocess", "annotate", "encode", "zstd", "phash", "total"]
+PERCENTILES = [50, 95, 99]
+
+def read_frames( source, max_frames=None ):
+    """ Frames from a folder of images or a video file, in order. """
+    if os.path.isdir(source):
+        for index, image_path in enumerate(list_images(source)):
+            if max_frames is not None and index >= max_frames:
+                return
+            yield cv2.imread(image_path)
+        return
+
+    video = cv2.VideoCapture(source)
+    assert video.isOpened(), f"Cannot open video {source}"
+    try:
+        frame_count = 0
+        while max_frames is None or frame_count < max_frames:
+            ret, frame = video.read()
+            if not ret:
+                break
+            frame_count += 1
+            yield frame
+    finally:
+        video.release()
+
+def summarize( samples ):
+    """ Percentiles and mean of a list of durations, in milliseconds. """
+    samples_ms = np.array(samples) * 1000
+    summary = {f"p{percentile}": float(np.percentile(samples_ms, percentile)) for percentile in PERCENTILES}
+    summary["mean"] = float(samples_ms.mean())
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark( model, frames, required_items, burst_size=1, warmup=3, show_bounding_boxes=False, encoding=None ):
+    """
+        Judge every `burst_size` consecutive frames as one capture, like the end of a gate countdown.
+        The first `warmup` captures are run but not recorded. Returns the per-step durations in seconds.
+        `encoding` holds the encode_image settings ( image_format, quality, scale, compress ), PNG + zstd by default.
+    """
+    samples = {step: [] for step in STEPS}
+    burst = []
+    captures = 0
+    for frame in frames:
+        burst.append(frame)
+        if len(burst) < burst_size:
+            continue
+
+        timings = {}
+        start = time.perf_counter()
+        # The guide overlay is drawn on every countdown frame, time it once per capture
+        with timed(timings, "guide"):
+            _, top_left, bottom_right = show_guide(burst[-1], 0, 0)
+        annotated, _, _ = run_inference(
+            model, burst, top_left, bottom_right, required_items, show_bounding_boxes, timings=timings
+        )
+        encode_image(annotated, timings, **(encoding or {}))
+        with timed(timings, "phash"):
+            dhash(annotated)
+        timings["total"] = time.perf_counter() - start
+        burst = []
+
+        captures += 1
+        if captures <= warmup:
+            continue
+        for step in STEPS:
+            # Steps that were skipped, e.g. zstd for JPEG, count as free
+            samples[step].append(timings.get(step, 0.0))
+    return samples
+
+def benchmark_report( checkpoint, backend, imgsz, source, required_items, burst_size=1, warmup=3, max_frames=None,
+                      show_bounding_boxes=False, encoding=None ):
+    model = load_model(checkpoint, backend, imgsz)
+    samples = run_benchmark(
+        model, read_frames(source, max_frames), required_items, burst_size, warmup, show_bounding_boxes, encoding
+    )
+    captures = len(samples["total"])
+    assert captures, f"Not enough frames in {source} for {warmup} warm-up captures of {burst_size} frames"
+    return {
+        "commit": git_commit(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__
+        },
+        "config": {
+            "checkpoint": checkpoint,
+            "backend": backend,
+            "imgsz": imgsz,
+            "source": source,
+            "burst_size": burst_size,
+            "warmup": warmup,
+            "show_bounding_boxes": show_bounding_boxes,
+            "encoding": encoding or {}
+        },
+        "captures": captures,
+        "captures_per_second": captures / sum(samples["total"]),
+        "steps_ms": {step: summarize(samples[step]) for step in STEPS}
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the gate's inference path and report per-step latency.")
+    parser.add_argument("source", help="Folder of images or a video file")
+    parser.add_argument("--checkpoint", default="checkpoints/yolo10s_trained1.pt")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="pytorch")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--burst", type=int, default=1, help="Frames judged together per capture")
+    parser.add_argument("--warmup", type=int, default=3, help="Captures run before timing starts")
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--required-items", default="person,helmet")
+    parser.add_argument("--show-bounding-boxes", action="store_true")
+    parser.add_argument("--image-format", choices=list(IMAGE_FORMATS), default="png")
+    parser.add_argument("--image-quality", type=int, default=85)
+    parser.add_argument("--image-scale", type=float, default=1.0)
+    parser.add_argument("--zstd", action=argparse.BooleanOptionalAction, default=True, help="zstd compress the encoded image")
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    args = parser.parse_args()
+
+    report = benchmark_report(
+        args.checkpoint,
+        args.backend,
+        args.imgsz,
+        args.source,
+        args.required_items.split(","),
+        args.burst,
+        args.warmup,
+        args.max_frames,
+        args.show_bounding_boxes,
+        {"image_format": args.image_format, "quality": args.image_quality, "scale": args.image_scale, "compress": args.zstd}
+    )
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    print(json.dumps(report, indent=2))
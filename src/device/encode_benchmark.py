@@ -0,0 +1,90 @@
+import json
+import time
+import argparse
+import numpy as np
+from device.benchmark import read_frames, summarize, git_commit
+from device.vision import IMAGE_FORMATS, guide_box, crop_guide_region, encode_image
+
+# Encode time against bytes on the wire for the evidence crops of recorded frames, for every encoder setting.
+# No model is needed, the guide region crop of each frame stands in for the annotated crop the gate uploads.
+
+def parse_list( spec, cast=str ):
+    return [cast(value) for value in spec.split(",") if value]
+
+def encoder_settings( image_formats, qualities, scales, compress ):
+    """ Every combination to measure, PNG once per scale since it ignores the quality. """
+    settings = []
+    for image_format in image_formats:
+        for scale in scales:
+            for quality in (qualities if IMAGE_FORMATS[image_format][2] is not None else [None]):
+                for zstd in compress:
+                    settings.append({"image_format": image_format, "quality": quality, "scale": scale, "compress": zstd})
+    return settings
+
+def run_encode_benchmark( crops, settings, warmup=3 ):
+    """ Encode every crop with every setting. Returns one result per setting, with encode time ( ms ) and size ( bytes ). """
+    results = []
+    for setting in settings:
+        durations = []
+        sizes = []
+        for index, crop in enumerate(crops):
+            start = time.perf_counter()
+            image_data, _, _ = encode_image(crop, **setting)
+            elapsed = time.perf_counter() - start
+            if index < warmup:
+                continue
+            durations.append(elapsed)
+            sizes.append(len(image_data))
+        results.append({
+            **setting,
+            "encode_ms": summarize(durations),
+            "bytes": {"mean": float(np.mean(sizes)), "p95": float(np.percentile(sizes, 95))}
+        })
+    return results
+
+def encode_report( source, image_formats, qualities, scales, compress, warmup=3, max_frames=None ):
+    crops = []
+    for frame in read_frames(source, max_frames):
+        top_left, bottom_right = guide_box(frame)
+        crops.append(crop_guide_region(frame, top_left, bottom_right).copy())
+    assert len(crops) > warmup, f"Not enough frames in {source} for {warmup} warm-up encodes"
+    results = run_encode_benchmark(crops, encoder_settings(image_formats, qualities, scales, compress), warmup)
+    # Relative to the encoding the gate used before formats were configurable
+    baseline = next((result for result in results if result["image_format"] == "png" and result["scale"] == 1 and result["compress"]), None)
+    if baseline:
+        for result in results:
+            result["bytes_vs_png_zstd"] = result["bytes"]["mean"] / baseline["bytes"]["mean"]
+            result["time_vs_png_zstd"] = result["encode_ms"]["mean"] / baseline["encode_ms"]["mean"]
+    return {
+        "commit": git_commit(),
+        "source": source,
+        "crops": len(crops) - warmup,
+        "crop_size": list(crops[0].shape[1::-1]),
+        "results": results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report encode time against upload size of the evidence crop for each encoder setting.")
+    parser.add_argument("source", help="Folder of images or a video file")
+    parser.add_argument("--formats", default="png,jpeg,webp")
+    parser.add_argument("--qualities", default="70,85,95", help="JPEG / WebP quality values")
+    parser.add_argument("--scales", default="1.0,0.75,0.5", help="Downscale factors applied before encoding")
+    parser.add_argument("--zstd", default="true,false", help="Whether to zstd compress the encoded image")
+    parser.add_argument("--warmup", type=int, default=3, help="Crops encoded before timing starts")
+    parser.add_argument("--max-frames", type=int, default=200)
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    args = parser.parse_args()
+
+    report = encode_report(
+        args.source,
+        parse_list(args.formats),
+        parse_list(args.qualities, int),
+        parse_list(args.scales, float),
+        parse_list(args.zstd, lambda value: value.lower() == "true"),
+        args.warmup,
+        args.max_frames
+    )
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,145 @@
+import time
+import cv2
+import numpy as np
+from device.hardware import PresenceSensor
+from device.vision import guide_box, crop_guide_region
+from device.metrics import TRIGGERS_REJECTED
+
+# Camera based triggering. A cheap check on a downscaled, greyscale copy of the guide region decides whether
+# someone is standing there, so the full PPE model only runs for real people and not for carts or doors
+# that trip the ultrasonic sensor.
+
+TRIGGER_MODES = ("ultrasonic", "camera", "fused")
+
+class PresenceGate:
+    """
+        Background subtraction on the guide region.
+        The background is a running average of the frames seen while nobody is there; the region counts as
+        occupied once at least `min_fill` of its pixels differ from it, and never before a background is known.
+        Unlike plain frame differencing this keeps reporting a person who stands still. With `use_hog` an occupied
+        region must also contain a person according to OpenCV's HOG pedestrian detector, which only runs once the
+        cheap check passes. When learning, a region that stays occupied for `reseed_after` seconds is taken to be a
+        changed scene ( lights, an open door, a background seeded with someone in it ) and becomes the background.
+    """
+    def __init__( self, min_fill=0.15, use_hog=False, width=160, pixel_threshold=25, learning_rate=0.05, reseed_after=60 ):
+        self.min_fill = min_fill
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.learning_rate = learning_rate
+        self.reseed_after = reseed_after
+        self.background = None
+        self._occupied_since = None
+        self.hog = None
+        if use_hog:
+            self.hog = cv2.HOGDescriptor()
+            self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+    def _prepare( self, frame ):
+        region = crop_guide_region(frame, *guide_box(frame))
+        height = max(1, region.shape[0] * self.width // region.shape[1])
+        small = cv2.resize(region, (self.width, height), interpolation=cv2.INTER_AREA)
+        return small, cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+    def _learn( self, grey ):
+        if self.background is None or self.background.shape != grey.shape:
+            self.background = grey.astype(np.float32)
+        else:
+            cv2.accumulateWeighted(grey, self.background, self.learning_rate)
+
+    def learn( self, frame ):
+        """ Fold a frame known to show the empty scene into the background. """
+        self._learn(self._prepare(frame)[1])
+
+    def foreground_fill( self, grey ):
+        if self.background is None or self.background.shape != grey.shape:
+            return 0.0
+        difference = cv2.absdiff(grey, cv2.convertScaleAbs(self.background))
+        return np.count_nonzero(difference > self.pixel_threshold) / difference.size
+
+    def occupied( self, frame, learn=True ):
+        """ Whether someone is in the guide region. With `learn`, empty frames are folded into the background. """
+        small, grey = self._prepare(frame)
+        if self.background is None or self.background.shape != grey.shape:
+            if learn:
+                self._learn(grey)
+            return False
+        is_occupied = self.foreground_fill(grey) >= self.min_fill
+        if is_occupied and self.hog is not None:
+            people, _ = self.hog.detectMultiScale(small, winStride=(8, 8), padding=(8, 8), scale=1.05)
+            is_occupied = len(people) > 0
+        if not learn:
+            return is_occupied
+        if not is_occupied:
+            self._occupied_since = None
+            self._learn(grey)
+        elif self._occupied_since is None:
+            self._occupied_since = time.monotonic()
+        elif self.reseed_after and time.monotonic() - self._occupied_since >= self.reseed_after:
+            print(f"Guide box occupied for {self.reseed_after:.0f}s, taking the current scene as the background")
+            self.background = grey.astype(np.float32)
+            self._occupied_since = None
+            is_occupied = False
+        return is_occupied
+
+class CameraTrigger( PresenceSensor ):
+    """ Watches the camera instead of a distance sensor, in range once the gate reports someone for `confirm_frames` frames in a row. """
+    def __init__( self, camera, gate, confirm_frames=3 ):
+        self.camera = camera
+        self.gate = gate
+        self.confirm_frames = confirm_frames
+
+    def wait_for_in_range( self, timeout=None, learn=True ):
+        """ With `learn` the frames the gate finds empty also update its background. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        consecutive = 0
+        while deadline is None or time.monotonic() < deadline:
+            ret, frame = self.camera.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            consecutive = consecutive + 1 if self.gate.occupied(frame, learn) else 0
+            if consecutive >= self.confirm_frames:
+                return True
+        return False
+
+class FusedTrigger( PresenceSensor ):
+    """
+        The distance sensor triggers, the camera has `confirm_timeout` seconds to confirm someone is in the guide box.
+        The background is learnt from a frame every `learn_interval` seconds while the sensor is idle, when the scene
+        is known to be empty. Frames read after the sensor fired are never learnt, so nobody becomes background.
+    """
+    def __init__( self, sensor, camera_trigger, confirm_timeout=1.0, learn_interval=0.1 ):
+        self.sensor = sensor
+        self.camera_trigger = camera_trigger
+        self.confirm_timeout = confirm_timeout
+        self.learn_interval = learn_interval
+
+    def wait_for_in_range( self, timeout=None ):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            poll = self.learn_interval if deadline is None else min(self.learn_interval, max(0.0, deadline - time.monotonic()))
+            if not self.sensor.wait_for_in_range(poll):
+                ret, frame = self.camera_trigger.camera.read()
+                if ret:
+                    self.camera_trigger.gate.learn(frame)
+                continue
+            # Once the sensor fired the camera gets its full window, even past the deadline, so a hit late in the
+            # caller's poll is not counted as unconfirmed
+            if self.camera_trigger.wait_for_in_range(self.confirm_timeout, learn=False):
+                return True
+            TRIGGERS_REJECTED.labels("unconfirmed").inc()
+            print("Distance sensor triggered but nobody is in the guide box, ignored")
+        return False
+
+    def close( self ):
+        self.sensor.close()
+
+def open_trigger( mode, sensor_factory, camera, gate, confirm_frames=3, confirm_timeout=1.0 ):
+    """ The presence trigger for `mode`, `sensor_factory` opens the distance sensor when one is needed. """
+    assert mode in TRIGGER_MODES, f"Invalid trigger mode: {mode}"
+    if mode == "ultrasonic":
+        return sensor_factory()
+    camera_trigger = CameraTrigger(camera, gate, confirm_frames)
+    if mode == "camera":
+        return camera_trigger
+    return FusedTrigger(sensor_factory(), camera_trigger, confirm_timeout)
@@ -0,0 +1,226 @@
+import os
+import time
+import threading
+import cv2
+from device.inference import list_images
+
+# The camera and presence sensor behind small interfaces, so the gate loop runs the same against real hardware
+# on the Pi and against recorded frames and a scripted sensor on any Linux box ( soak tests, profiling ).
+
+class Camera:
+    """ Source of BGR frames, same contract as cv2.VideoCapture.read(). """
+    def read( self, image=None ):
+        """ Returns ( ret, frame ). `image` is a buffer of the right size that may be filled in place of allocating one. """
+        raise NotImplementedError
+
+    def release( self ):
+        pass
+
+class OpenCVCamera( Camera ):
+    """
+        A V4L2 / USB camera. `width`, `height`, `fourcc` and `fps` are requested from the driver, 0 / None keep its defaults.
+        MJPG lets USB cameras deliver full frame rates at resolutions where raw YUYV would not fit the bus.
+    """
+    def __init__( self, index=0, width=0, height=0, fourcc=None, fps=0 ):
+        self.capture = cv2.VideoCapture(index)
+        # The format is set first, some drivers only offer higher resolutions once it is MJPG
+        if fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width and height:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        print(
+            f"Camera {index}: {int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))} "
+            f"@ {self.capture.get(cv2.CAP_PROP_FPS):.0f} fps"
+        )
+
+    def read( self, image=None ):
+        return self.capture.read(image)
+
+    def release( self ):
+        self.capture.release()
+
+class FrameGrabber( Camera ):
+    """
+        Drains a camera on its own thread into a small ring of frame buffers that are allocated once and reused, so the driver's queue never
+        fills up with stale frames and readers always get the newest frame.
+        read() waits for a frame newer than the last one it returned and hands out the buffer itself, without copying.
+        A frame stays valid until `size - 1` newer frames have been grabbed, copy it to keep it longer.
+    """
+    def __init__( self, camera, size=4, timeout=2.0 ):
+        self.camera = camera
+        self.timeout = timeout
+        self.slots = [None] * size
+        self.sequence = 0
+        self.last_read = {}
+        self.failures = 0
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+
+    def _run( self ):
+        while not self._stopping.is_set():
+            index = (self.sequence + 1) % len(self.slots)
+            # The slot being written is never the newest one, which is what readers hold
+            ret, frame = self.camera.read(self.slots[index])
+            if not ret:
+                self.failures += 1
+                time.sleep(0.01)
+                continue
+            with self._condition:
+                self.slots[index] = frame
+                self.sequence += 1
+                self._condition.notify_all()
+
+    def read( self, image=None ):
+        reader = threading.get_ident()
+        with self._condition:
+            fresh = self._condition.wait_for(
+                lambda: self.sequence > self.last_read.get(reader, 0) or self._stopping.is_set(),
+                self.timeout
+            )
+            if not fresh or self._stopping.is_set():
+                return False, None
+            self.last_read[reader] = self.sequence
+            return True, self.slots[self.sequence % len(self.slots)]
+
+    def release( self ):
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._thread.join(self.timeout)
+        self.camera.release()
+
+class ReplayCamera( Camera ):
+    """
+        Serves frames from a folder of images or a video file, looping at the end.
+        With `fps` 0 a frame is returned as soon as it is asked for, so the gate runs as fast as the pipeline allows.
+    """
+    def __init__( self, source, fps=0, loop=True ):
+        self.source = source
+        self.fps = fps
+        self.loop = loop
+        self.last_read = 0.0
+        self.frames = None
+        self.video = None
+        self.position = 0
+        if os.path.isdir(source):
+            # Images are decoded once up front so disk reads do not show up in the measurements
+            self.frames = [cv2.imread(image_path) for image_path in list_images(source)]
+            assert self.frames, f"No images found in {source}"
+        else:
+            self.video = cv2.VideoCapture(source)
+            assert self.video.isOpened(), f"Cannot open video {source}"
+
+    def read( self, image=None ):
+        if self.fps:
+            wait = self.last_read + 1 / self.fps - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_read = time.monotonic()
+
+        if self.frames is not None:
+            if self.position >= len(self.frames):
+                if not self.loop:
+                    return False, None
+                self.position = 0
+            frame = self.frames[self.position]
+            self.position += 1
+            return True, frame.copy()
+
+        ret, frame = self.video.read()
+        if not ret and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.video.read()
+        return ret, frame
+
+    def release( self ):
+        if self.video is not None:
+            self.video.release()
+
+class PresenceSensor:
+    """ Tells the gate when someone is standing in front of it. """
+    def wait_for_in_range( self, timeout=None ):
+        """ Block until someone is in range. Returns False if `timeout` seconds passed first. """
+        raise NotImplementedError
+
+    def close( self ):
+        pass
+
+class UltrasonicSensor( PresenceSensor ):
+    def __init__( self, echo=4, trigger=17, threshold_distance=0.75, max_distance=2 ):
+        from gpiozero import DistanceSensor
+        self.sensor = DistanceSensor(echo=echo, trigger=trigger)
+        self.sensor.threshold_distance = threshold_distance
+        self.sensor.max_distance = max_distance
+
+    def wait_for_in_range( self, timeout=None ):
+        return self.sensor.wait_for_in_range(timeout)
+
+    def close( self ):
+        self.sensor.close()
+
+def parse_sensor_script( script ):
+    """ "2.0:3,0.5:6" -> [ ( 2.0, 3.0 ), ( 0.5, 6.0 ) ], distances in meters held for the given seconds. """
+    steps = []
+    for step in script.split(","):
+        distance, seconds = step.split(":")
+        steps.append((float(distance), float(seconds)))
+    assert steps and sum(seconds for _, seconds in steps) > 0, f"Invalid sensor script: {script}"
+    return steps
+
+class ScriptedSensor( PresenceSensor ):
+    """
+        Replays a looping script of distances over time, e.g. nobody for 3 seconds then a person for 6.
+        While the scripted distance stays in range the gate keeps capturing, like a queue of people at the door.
+    """
+    def __init__( self, steps, threshold_distance=0.75, poll_interval=0.01 ):
+        self.steps = steps
+        self.threshold_distance = threshold_distance
+        self.poll_interval = poll_interval
+        self.cycle = sum(seconds for _, seconds in steps)
+        self.started_at = time.monotonic()
+        self._closed = threading.Event()
+
+    @property
+    def distance( self ):
+        position = (time.monotonic() - self.started_at) % self.cycle
+        for distance, seconds in self.steps:
+            if position < seconds:
+                return distance
+            position -= seconds
+        return self.steps[-1][0]
+
+    @property
+    def in_range( self ):
+        return self.distance < self.threshold_distance
+
+    def wait_for_in_range( self, timeout=None ):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.in_range:
+            if self._closed.wait(self.poll_interval) or (deadline is not None and time.monotonic() >= deadline):
+                return False
+        return True
+
+    def close( self ):
+        self._closed.set()
+
+def open_camera( source="0", fps=0, width=0, height=0, fourcc=None, grabber=True ):
+    """
+        A camera index opens the real camera, behind a FrameGrabber unless `grabber` is False.
+        Anything else is replayed from disk, frame by frame as it is read so replays can run faster than real time.
+    """
+    if source.isdigit():
+        camera = OpenCVCamera(int(source), width, height, fourcc, fps)
+        return FrameGrabber(camera) if grabber else camera
+    return ReplayCamera(source, fps)
+
+def open_presence_sensor( kind="ultrasonic", script=None, threshold_distance=0.75, max_distance=2, echo=4, trigger=17 ):
+    if kind == "ultrasonic":
+        return UltrasonicSensor(echo, trigger, threshold_distance, max_distance)
+    if kind == "scripted":
+        return ScriptedSensor(parse_sensor_script(script or "2.0:1,0.5:10"), threshold_distance)
+    raise ValueError(f"Invalid presence sensor: {kind}")
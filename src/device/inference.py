@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Export format and artifact name of every backend, artifacts are written next to the checkpoint by ultralytics
+BACKENDS = {
+    "pytorch": None,
+    "onnx": ("onnx", "{stem}.onnx"),
+    "openvino": ("openvino", "{stem}_openvino_model"),
+    "ncnn": ("ncnn", "{stem}_ncnn_model"),
+    "onnx_int8": ("onnx", "{stem}_int8.onnx")
+}
+# Backends whose exported graph accepts any batch size, the others are fed one image at a time
+BATCHED_BACKENDS = ["pytorch", "onnx", "openvino", "onnx_int8"]
+# Backends that need calibration images, their artifacts are made by device.quantize instead of a plain export
+QUANTIZED_BACKENDS = ["onnx_int8"]
+# ultralytics ( and torch behind it ) is imported on first use, it takes seconds to import on a Pi
+
+class InferenceBackend:
+    """
+        A loaded model behind the same call interface for every backend.
+        Pre-processing ( letterbox to `imgsz` ), post-processing and class names all come from ultralytics,
+        so detections only differ by the numerical differences of the runtimes.
+    """
+    def __init__( self, model, backend, imgsz ):
+        self.model = model
+        self.backend = backend
+        self.imgsz = imgsz
+
+    @property
+    def names( self ):
+        return self.model.names
+
+    def __call__( self, images, **kwargs ):
+        if not isinstance(images, list):
+            images = [images]
+        if self.backend in BATCHED_BACKENDS or len(images) == 1:
+            return self.model(images, imgsz=self.imgsz, verbose=False, **kwargs)
+        results = []
+        for image in images:
+            results.extend(self.model([image], imgsz=self.imgsz, verbose=False, **kwargs))
+        return results
+
+    def warm_up( self, batch_sizes=(1,), runs=2 ):
+        """
+            Run blank images of the input size through the model at each of `batch_sizes`,
+            so graph compilation and buffer allocation happen before the first real capture.
+            Returns the seconds per image of the last run, a fair first estimate of the warm latency.
+        """
+        import numpy as np
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        per_image = None
+        for batch_size in sorted(set(batch_sizes)):
+            for _ in range(runs):
+                start = time.perf_counter()
+                self([dummy] * batch_size)
+                per_image = (time.perf_counter() - start) / batch_size
+        return per_image
+
+def artifact_path( checkpoint, backend ):
+    stem = os.path.splitext(checkpoint)[0]
+    return BACKENDS[backend][1].format(stem=stem)
+
+def _stamp_path( artifact ):
+    return f"{artifact.rstrip(os.sep)}.export.json"
+
+def _read_stamp( artifact ):
+    if not os.path.exists(artifact) or not os.path.exists(_stamp_path(artifact)):
+        return None
+    with open(_stamp_path(artifact)) as stamp_file:
+        return json.load(stamp_file)
+
+def write_stamp( artifact, stamp ):
+    with open(_stamp_path(artifact), "w") as stamp_file:
+        json.dump(stamp, stamp_file)
+
+def is_up_to_date( artifact, stamp ):
+    """ Whether the artifact was made from the same checkpoint and input size, extra fields in its stamp are ignored. """
+    saved_stamp = _read_stamp(artifact)
+    return saved_stamp is not None and {key: saved_stamp.get(key) for key in stamp} == stamp
+
+def export_stamp( checkpoint, backend, imgsz ):
+    checkpoint_stat = os.stat(checkpoint)
+    return {
+        "checkpoint": os.path.abspath(checkpoint),
+        "checkpoint_size": checkpoint_stat.st_size,
+        "checkpoint_mtime": checkpoint_stat.st_mtime,
+        "backend": backend,
+        "imgsz": imgsz
+    }
+
+def export_model( checkpoint, backend, imgsz=640, force=False ):
+    """
+        Export the checkpoint for `backend` once and cache the artifact.
+        The export is redone only if the checkpoint or input size changed since the cached one was made.
+        Returns the path of the artifact.
+    """
+    assert backend in BACKENDS, f"Invalid inference backend: {backend}"
+    if BACKENDS[backend] is None:
+        return checkpoint
+
+    artifact = artifact_path(checkpoint, backend)
+    stamp = export_stamp(checkpoint, backend, imgsz)
+    if not force and is_up_to_date(artifact, stamp):
+        return artifact
+    if backend in QUANTIZED_BACKENDS:
+        raise FileNotFoundError(
+            f"No up to date {backend} model for {checkpoint}, create it with: "
+            f"python -m device.quantize --checkpoint {checkpoint} --imgsz {imgsz} --images [calibration image folder]"
+        )
+
+    from ultralytics import YOLO
+    print(f"Exporting {checkpoint} for {backend}...")
+    source_model = YOLO(checkpoint)
+    export_format = BACKENDS[backend][0]
+    exported = source_model.export(format=export_format, imgsz=imgsz, dynamic=backend in BATCHED_BACKENDS)
+    if os.path.abspath(exported) != os.path.abspath(artifact):
+        os.replace(exported, artifact)
+
+    exported_model = YOLO(artifact, task="detect")
+    if dict(exported_model.names) != dict(source_model.names):
+        raise RuntimeError(f"Class names of the {backend} export do not match the checkpoint")
+
+    write_stamp(artifact, stamp)
+    return artifact
+
+def load_model( checkpoint, backend="pytorch", imgsz=640 ):
+    """ Load the checkpoint with the chosen backend, exporting it first if there is no up to date artifact. """
+    from ultralytics import YOLO
+    artifact = export_model(checkpoint, backend, imgsz)
+    return InferenceBackend(YOLO(artifact, task="detect"), backend, imgsz)
+
+# --- Parity check ---
+def box_iou( box_a, box_b ):
+    x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+def detections_from_result( result, names ):
+    """ ( class name, confidence, xyxy box ) of every detection in an ultralytics result. """
+    return [
+        (names[int(cls_id)], float(confidence), box)
+        for cls_id, confidence, box in zip(result.boxes.cls.tolist(), result.boxes.conf.tolist(), result.boxes.xyxy.tolist())
+    ]
+
+def compare_detections( reference, candidate, iou_threshold=0.5 ):
+    """ Greedily match candidate detections to reference detections of the same class. Returns ( matched, max confidence delta ). """
+    unmatched = list(candidate)
+    matched = 0
+    max_confidence_delta = 0.0
+    for class_name, confidence, box in sorted(reference, key=lambda detection: -detection[1]):
+        best = None
+        for detection in unmatched:
+            if detection[0] == class_name and box_iou(box, detection[2]) >= iou_threshold:
+                if best is None or box_iou(box, detection[2]) > box_iou(box, best[2]):
+                    best = detection
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+            max_confidence_delta = max(max_confidence_delta, abs(confidence - best[1]))
+    return matched, max_confidence_delta
+
+def list_images( image_dir ):
+    return sorted(
+        os.path.join(image_dir, file_name) for file_name in os.listdir(image_dir)
+        if file_name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp"))
+    )
+
+def check_parity( checkpoint, backend, image_dir, imgsz=640, min_agreement=0.95 ):
+    """
+        Run every image through the PyTorch checkpoint and `backend`, and compare the detections.
+        Returns a report; `passed` is False if fewer than `min_agreement` of the detections match
+        ( same class, IoU >= 0.5 ) in either direction.
+    """
+    import cv2
+    baseline = load_model(checkpoint, "pytorch", imgsz)
+    candidate = load_model(checkpoint, backend, imgsz)
+    assert dict(baseline.names) == dict(candidate.names), "Class names differ between backends"
+
+    reference_total = candidate_total = matched_total = 0
+    max_confidence_delta = 0.0
+    for image_path in list_images(image_dir):
+        image = cv2.imread(image_path)
+        reference = detections_from_result(baseline(image)[0], baseline.names)
+        detections = detections_from_result(candidate(image)[0], candidate.names)
+        matched, confidence_delta = compare_detections(reference, detections)
+        reference_total += len(reference)
+        candidate_total += len(detections)
+        matched_total += matched
+        max_confidence_delta = max(max_confidence_delta, confidence_delta)
+
+    recall = matched_total / reference_total if reference_total else 1.0
+    precision = matched_total / candidate_total if candidate_total else 1.0
+    return {
+        "backend": backend,
+        "reference_detections": reference_total,
+        "backend_detections": candidate_total,
+        "matched": matched_total,
+        "recall": recall,
+        "precision": precision,
+        "max_confidence_delta": max_confidence_delta,
+        "passed": recall >= min_agreement and precision >= min_agreement
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the detector for a CPU backend and check it against PyTorch.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--checkpoint", default="checkpoints/yolo10s_trained1.pt")
+    parser.add_argument("--backend", choices=list(BACKENDS), required=True)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--images", help="Folder of images for the parity check")
+    parser.add_argument("--min-agreement", type=float, default=0.95)
+    parser.add_argument("--force", action="store_true", help="Export again even if the cached artifact is up to date")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_model(args.checkpoint, args.backend, args.imgsz, args.force))
+    else:
+        assert args.images, "--images is required for the parity check"
+        report = check_parity(args.checkpoint, args.backend, args.images, args.imgsz, args.min_agreement)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["passed"] else 1)
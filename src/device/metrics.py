@@ -0,0 +1,81 @@
+from prometheus_client import Counter, Histogram, start_http_server
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+# Prometheus metrics of the gate, served by a small local exporter ( METRICS_PORT in .env ).
+# Queue depths and stage counters are read from the pipeline and outbox when scraped rather than tracked twice.
+
+STEP_SECONDS = Histogram(
+    "ppe_device_step_seconds",
+    "Time spent in each step of judging a capture ( crop_resize, forward, postprocess, annotate, encode, zstd, phash )",
+    ["step"]
+)
+CAPTURES = Counter("ppe_device_captures_total", "Captures judged, by gate and outcome", ["gate", "result"])
+REPEAT_CAPTURES = Counter(
+    "ppe_device_repeat_captures_total",
+    "Captures that repeat a recent one of the same gate ( perceptual hash ), not alerted and sent without their image",
+    ["gate"]
+)
+TRIGGERS_REJECTED = Counter(
+    "ppe_device_triggers_rejected_total",
+    "Triggers that did not lead to inference ( unconfirmed: not seen by the camera, left: gone before the capture )",
+    ["reason"]
+)
+CAMERA_READ_FAILURES = Counter("ppe_device_camera_read_failures_total", "Frames the camera failed to deliver")
+SCHEDULER_BATCH_IMAGES = Histogram(
+    "ppe_device_scheduler_batch_images",
+    "Images in each forward pass of the shared model",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "ppe_device_scheduler_wait_seconds",
+    "Time a gate's images waited for the shared model",
+    ["gate"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+UPLOAD_SECONDS = Histogram("ppe_device_upload_seconds", "Round trip of uploads to the server", ["endpoint"])
+UPLOAD_FAILURES = Counter("ppe_device_upload_failures_total", "Outbox flushes that failed and were retried with backoff")
+ALERTS = Counter(
+    "ppe_device_alerts_total",
+    "Telegram alerts by outcome ( sent, coalesced: folded into a summary, dropped: queue full, failed )",
+    ["result"]
+)
+ALERT_SECONDS = Histogram(
+    "ppe_device_alert_seconds",
+    "Time from capture to the Telegram alert being sent",
+    buckets=(0.5, 1, 2, 3, 5, 7.5, 10, 15, 30, 60)
+)
+
+def record_timings( timings ):
+    """ Observe the step durations collected by device.vision. """
+    for step, seconds in timings.items():
+        STEP_SECONDS.labels(step).observe(seconds)
+
+class GateCollector:
+    """ Reads the state of every gate's pipeline and of the outbox at scrape time. `pipelines` maps gate names to pipelines. """
+    def __init__( self, pipelines, outbox ):
+        self.pipelines = pipelines
+        self.outbox = outbox
+
+    def collect( self ):
+        labels = ["gate", "stage"]
+        queue_depth = GaugeMetricFamily("ppe_device_queue_depth", "Items waiting at each pipeline stage", labels=labels)
+        processed = CounterMetricFamily("ppe_device_stage_processed", "Items handled by each pipeline stage", labels=labels)
+        dropped = CounterMetricFamily("ppe_device_stage_dropped", "Items dropped by the backpressure policy of each stage", labels=labels)
+        failed = CounterMetricFamily("ppe_device_stage_failed", "Items whose handler raised at each stage", labels=labels)
+        for gate_name, pipeline in self.pipelines.items():
+            for stage_name, stage_stats in pipeline.stats().items():
+                queue_depth.add_metric([gate_name, stage_name], stage_stats["queued"])
+                processed.add_metric([gate_name, stage_name], stage_stats["processed"])
+                dropped.add_metric([gate_name, stage_name], stage_stats["dropped"])
+                failed.add_metric([gate_name, stage_name], stage_stats["failed"])
+        yield from (queue_depth, processed, dropped, failed)
+
+        pending = self.outbox.pending()
+        yield GaugeMetricFamily("ppe_device_outbox_events", "Events spooled and waiting for upload", value=pending["events"])
+        yield GaugeMetricFamily("ppe_device_outbox_bytes", "Size of the spooled events", value=pending["bytes"])
+        yield CounterMetricFamily("ppe_device_outbox_evicted", "Spooled events evicted to stay within the disk budget", value=pending["evicted"])
+
+def start_exporter( port, pipelines, outbox, address="0.0.0.0" ):
+    REGISTRY.register(GateCollector(pipelines, outbox))
+    start_http_server(port, address)
+    print(f"Metrics served on http://{address}:{port}/metrics")
@@ -0,0 +1,349 @@
+import os
+import json
+import base64
+import random
+import sqlite3
+import threading
+import time
+import cv2
+import zstd
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from device.metrics import UPLOAD_SECONDS, UPLOAD_FAILURES
+
+class Outbox:
+    """
+        Durable on-device spool for events waiting to be uploaded.
+        Events are written to a SQLite database ( WAL mode ) before anything touches the network,
+        a background flusher then drains them in batches over a single keep-alive session.
+        Images are spooled as encoded by the gate ( PNG, JPEG or WebP, optionally zstd compressed ) with their content type,
+        and sent as binary multipart files, or base64 encoded in JSON for servers that predate binary uploads.
+        Servers without the batch endpoint only take zstd compressed PNGs, other images are re-encoded for them.
+        When the spool grows past `max_bytes`, the oldest unflagged events are evicted first,
+        flagged ( violation ) events are only evicted once no unflagged events are left.
+        Events the gate judged to repeat a recent capture are first sent without their image, for the server to fold into
+        the earlier event. The image is only sent if the server could not find that event.
+    """
+    def __init__(
+        self,
+        path,
+        server_url,
+        api_key,
+        max_bytes=256 * 1024 * 1024,
+        batch_size=20,
+        timeout=10,
+        min_backoff=1,
+        max_backoff=300,
+        max_known_hashes=5000,
+        upload_format="multipart"
+    ):
+        self.server_url = server_url
+        self.api_key = api_key
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_known_hashes = max_known_hashes
+        assert upload_format in ["multipart", "json"], f"Invalid upload format: {upload_format}"
+        self.upload_format = upload_format
+        self.backoff = 0
+        self.evicted = 0
+        self.batch_supported = True
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                flagged INTEGER NOT NULL,
+                device_name TEXT NOT NULL,
+                image TEXT,
+                size INTEGER NOT NULL
+            )
+        """)
+        # Spools created before image hashes were tracked
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        if "image_hash" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN image_hash TEXT")
+        # Spools created before the image format was configurable only hold zstd compressed PNGs
+        if "content_type" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN content_type TEXT")
+            self._db.execute("ALTER TABLE outbox ADD COLUMN compressed INTEGER")
+        if "perceptual_hash" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN perceptual_hash TEXT")
+            self._db.execute("ALTER TABLE outbox ADD COLUMN repeat INTEGER")
+        # Hashes of images the server is known to hold, events with these images are sent as hash only
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS known_hashes (
+                image_hash TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL
+            )
+        """)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = api_key
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+
+    def start( self ):
+        self._thread.start()
+
+    def stop( self, timeout=None ):
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def put( self, image_data, flagged, device_name, created_at=None, image_hash=None, content_type="image/png", compressed=True,
+             perceptual_hash=None, repeat=False ):
+        """
+            Spool an event for upload, returns the local spool id. `compressed` tells whether image_data is zstd compressed,
+            `repeat` whether the gate matched its `perceptual_hash` to a recent capture.
+        """
+        size = len(image_data or "") + len(device_name)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (created_at, flagged, device_name, image, size, image_hash, content_type, compressed, perceptual_hash, repeat) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (created_at or time.time(), int(flagged), device_name, image_data, size, image_hash, content_type, int(compressed),
+                 perceptual_hash, int(repeat))
+            )
+            self._evict()
+        self._wake.set()
+        return cursor.lastrowid
+
+    def pending( self ):
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox").fetchone()
+        return {"events": count, "bytes": size, "evicted": self.evicted}
+
+    def _evict( self ):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM outbox").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute(
+                "SELECT id, size FROM outbox ORDER BY flagged ASC, id ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (row[0],))
+            total -= row[1]
+            self.evicted += 1
+            print(f"Outbox over budget, evicted spooled event {row[0]}")
+
+    def _next_batch( self ):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, created_at, flagged, device_name, image, image_hash, COALESCE(content_type, 'image/png'), COALESCE(compressed, 1), "
+                "perceptual_hash, COALESCE(repeat, 0) FROM outbox ORDER BY id ASC LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+
+    def _delete( self, spool_ids ):
+        if not spool_ids:
+            return
+        with self._lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(spool_id,) for spool_id in spool_ids])
+
+    def _remember_hashes( self, image_hashes ):
+        image_hashes = [(image_hash, time.time()) for image_hash in image_hashes if image_hash]
+        if not image_hashes:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO known_hashes (image_hash, last_seen) VALUES (?, ?)", image_hashes)
+            self._db.execute(
+                "DELETE FROM known_hashes WHERE image_hash NOT IN (SELECT image_hash FROM known_hashes ORDER BY last_seen DESC LIMIT ?)",
+                (self.max_known_hashes,)
+            )
+
+    def _forget_hash( self, image_hash ):
+        with self._lock:
+            self._db.execute("DELETE FROM known_hashes WHERE image_hash = ?", (image_hash,))
+
+    def _image_required( self, row ):
+        """ The server does not hold the image of this event, send it in full next time. """
+        self._forget_hash(row[5])
+        with self._lock:
+            self._db.execute("UPDATE outbox SET repeat = 0 WHERE id = ?", (row[0],))
+
+    def _known_hashes( self, batch ):
+        image_hashes = [row[5] for row in batch if row[5]]
+        if not image_hashes:
+            return set()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT image_hash FROM known_hashes WHERE image_hash IN ({', '.join('?' * len(image_hashes))})",
+                image_hashes
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _event_json( self, row, known_hashes, image_file=None, legacy=False ):
+        """
+            Event metadata, with the image inlined as base64 unless it is sent as the multipart file `image_file`.
+            With `legacy` the image is always inlined as a zstd compressed PNG, the only image servers without the
+            batch endpoint accept, even for repeats and images the server already holds.
+        """
+        _, created_at, flagged, device_name, image_data, image_hash, content_type, compressed, perceptual_hash, repeat = row
+        event_json = {
+            "flagged": bool(flagged),
+            "device_name": device_name,
+            "created_at": created_at,
+            "content_type": content_type
+        }
+        if perceptual_hash:
+            event_json["perceptual_hash"] = perceptual_hash
+        # Servers without the batch endpoint reject events without an image, repeats included
+        if legacy:
+            event_json["image"] = self._image_base64(self._legacy_image(image_data, content_type, compressed))
+            event_json["content_type"] = "image/png"
+            event_json["compressed"] = True
+        # The server already holds this image, skip re-sending the bytes
+        elif image_hash and image_hash in known_hashes:
+            event_json["image_hash"] = image_hash
+        # Expected to be folded into an earlier event, which already has an image
+        elif repeat and perceptual_hash:
+            event_json["repeat"] = True
+        elif image_file and image_data:
+            event_json["image_file"] = image_file
+        else:
+            event_json["image"] = self._image_base64(image_data)
+            event_json["compressed"] = bool(compressed)
+        return event_json
+
+    def _image_bytes( self, image_data ):
+        # Spools written before binary uploads hold base64 text
+        return base64.b64decode(image_data) if isinstance(image_data, str) else image_data
+
+    def _legacy_image( self, image_data, content_type, compressed ):
+        """ The image as a zstd compressed PNG, re-encoded unless it already is one. """
+        if image_data is None or (compressed and content_type in (None, "image/png")):
+            return image_data
+        image_bytes = self._image_bytes(image_data)
+        if compressed:
+            image_bytes = zstd.decompress(image_bytes)
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        _, buffer = cv2.imencode(".png", image)
+        return zstd.compress(buffer.tobytes())
+
+    def _image_base64( self, image_data ):
+        if image_data is None or isinstance(image_data, str):
+            return image_data
+        return base64.b64encode(image_data).decode("utf-8")
+
+    def _send( self, row ):
+        """ Upload one spooled event to a server without the batch endpoint. Returns True if it should be removed from the spool. """
+        with UPLOAD_SECONDS.labels("log_event").time():
+            upload_req = self.session.post(
+                f"{self.server_url}/api/log_event",
+                json=self._event_json(row, self._known_hashes([row]), legacy=True),
+                timeout=self.timeout
+            )
+        if upload_req.status_code == 200:
+            json_response = upload_req.json()
+            print(f"Event logged successfully with ID: {json_response['event_id']}")
+            # Only servers that deduplicate images echo the hash back
+            self._remember_hashes([json_response.get("image_hash")])
+            return True
+        if upload_req.status_code == 409 and upload_req.json().get("image_required"):
+            # Server lost track of the image, or found no event to fold a repeat into
+            self._image_required(row)
+        if upload_req.status_code == 400:
+            # The server will never accept this payload, retrying would block the spool forever
+            print(f"Dropping rejected event {row[0]}: {upload_req.text}")
+            return True
+        raise requests.HTTPError(f"{upload_req.status_code}, {upload_req.text}")
+
+    def _send_batch( self, batch ):
+        """ Upload a batch through /api/log_events. Returns the spool ids to remove and whether anything should be retried. """
+        known_hashes = self._known_hashes(batch)
+        if self.upload_format == "multipart":
+            events = []
+            files = {}
+            for index, row in enumerate(batch):
+                event_json = self._event_json(row, known_hashes, image_file=f"image{index}")
+                if "image_file" in event_json:
+                    # The part's content type tells the server whether to decompress it
+                    file_type = "application/zstd" if row[7] else row[6]
+                    files[event_json["image_file"]] = (event_json["image_file"], self._image_bytes(row[4]), file_type)
+                events.append(event_json)
+            if files:
+                request_args = {"data": {"events": json.dumps(events)}, "files": files}
+            else:
+                request_args = {"json": {"events": events}}
+        else:
+            request_args = {"json": {"events": [self._event_json(row, known_hashes) for row in batch]}}
+        with UPLOAD_SECONDS.labels("log_events").time():
+            upload_req = self.session.post(
+                f"{self.server_url}/api/log_events",
+                timeout=self.timeout * 3,
+                **request_args
+            )
+        if upload_req.status_code == 404:
+            # Server predates the batch endpoint
+            self.batch_supported = False
+            raise requests.HTTPError("Batch upload not supported by server, falling back to single uploads")
+        if upload_req.status_code != 200:
+            raise requests.HTTPError(f"{upload_req.status_code}, {upload_req.text}")
+
+        done = []
+        retry = False
+        for row, result in zip(batch, upload_req.json()["results"]):
+            if "event_id" in result:
+                done.append(row[0])
+            elif result.get("image_required"):
+                self._image_required(row)
+                retry = True
+            elif result.get("retryable"):
+                retry = True
+            else:
+                print(f"Dropping rejected event {row[0]}: {result['error']}")
+                done.append(row[0])
+        self._remember_hashes([result.get("image_hash") for result in upload_req.json()["results"]])
+        print(f"Batch of {len(batch)} events uploaded, {len(done)} removed from spool")
+        return done, retry
+
+    def flush( self ):
+        """ Drain one batch. Returns the number of events removed, raises on transport or server errors. """
+        batch = self._next_batch()
+        if not batch:
+            return 0
+        if self.batch_supported:
+            done, retry = self._send_batch(batch)
+            self._delete(done)
+            if retry:
+                raise requests.HTTPError(f"{len(batch) - len(done)} events failed on the server")
+            return len(done)
+
+        done = []
+        try:
+            for row in batch:
+                if self._send(row):
+                    done.append(row[0])
+        finally:
+            self._delete(done)
+        return len(done)
+
+    def _run( self ):
+        while not self._stopping.is_set():
+            try:
+                flushed = self.flush()
+                self.backoff = 0
+            except Exception as e:
+                UPLOAD_FAILURES.inc()
+                self.backoff = min(self.max_backoff, max(self.min_backoff, self.backoff * 2))
+                print(f"Error uploading events: {e}. Retrying in {self.backoff}s")
+                # Jitter so a fleet of devices does not hammer the server in lockstep after an outage
+                self._stopping.wait(self.backoff * random.uniform(0.5, 1.0))
+                continue
+            if flushed == 0:
+                self._wake.wait(timeout=30)
+                self._wake.clear()
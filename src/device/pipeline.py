@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# How a stage behaves when its queue is full:
+#   block       - the producer waits until there is room (nothing is lost, the gate may stall)
+#   drop_oldest - the oldest queued item is discarded to make room for the new one
+#   drop_newest - the new item is discarded and the queue is left untouched
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+_STOP = object()
+
+class Stage:
+    """
+        A pool of worker threads fed by a bounded queue.
+        Each item taken off the queue is passed to `handler`; a non-None return value
+        is forwarded to the next stage in the pipeline.
+    """
+    def __init__( self, name, handler, maxsize=4, policy="block", workers=1 ):
+        assert policy in BACKPRESSURE_POLICIES, f"Invalid backpressure policy: {policy}"
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.inbox = queue.Queue(maxsize=maxsize)
+        self.next_stage = None
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start( self ):
+        for thread in self._threads:
+            thread.start()
+
+    def put( self, item ):
+        """ Queue an item according to the backpressure policy. Returns False if an item was dropped. """
+        if self.policy == "block":
+            self.inbox.put(item)
+            return True
+
+        try:
+            self.inbox.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == "drop_newest":
+            self._count_drop()
+            return False
+
+        # drop_oldest: evict until the new item fits
+        while True:
+            try:
+                self.inbox.get_nowait()
+                self.inbox.task_done()
+                self._count_drop()
+            except queue.Empty:
+                pass
+            try:
+                self.inbox.put_nowait(item)
+                return False
+            except queue.Full:
+                continue
+
+    def stop( self, timeout=None ):
+        # Sentinels bypass the backpressure policy so they are never dropped
+        for _ in self._threads:
+            self.inbox.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _count_drop( self ):
+        with self._lock:
+            self.dropped += 1
+        print(f"[{self.name}] Queue full, dropped an item ({self.policy})")
+
+    def _run( self ):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                self.inbox.task_done()
+                break
+            try:
+                result = self.handler(item)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                print(f"[{self.name}] Error: {e}")
+                result = None
+                with self._lock:
+                    self.failed += 1
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+            self.inbox.task_done()
+
+class Pipeline:
+    """ A chain of stages, each handing its results to the next one. """
+    def __init__( self, stages ):
+        self.stages = stages
+        for current_stage, next_stage in zip(stages, stages[1:]):
+            current_stage.next_stage = next_stage
+
+    def start( self ):
+        for stage in self.stages:
+            stage.start()
+
+    def submit( self, item ):
+        return self.stages[0].put(item)
+
+    def stop( self, timeout=None ):
+        # Stop upstream first so every queued item is drained downstream
+        for stage in self.stages:
+            stage.stop(timeout)
+
+    def stats( self ):
+        return {
+            stage.name: {
+                "queued": stage.inbox.qsize(),
+                "processed": stage.processed,
+                "dropped": stage.dropped,
+                "failed": stage.failed
+            }
+            for stage in self.stages
+        }
+
+class ThroughputMeter:
+    """ Counts events over a sliding window and reports them as a per-minute rate. """
+    def __init__( self, window=600 ):
+        self.window = window
+        self.started_at = time.time()
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def mark( self ):
+        now = time.time()
+        with self._lock:
+            self._events.append(now)
+            while self._events and now - self._events[0] > self.window:
+                self._events.popleft()
+
+    def per_minute( self ):
+        now = time.time()
+        with self._lock:
+            count = len(self._events)
+        span = min(self.window, now - self.started_at)
+        return count * 60 / span if span > 0 else 0.0
+
+class LatencyEstimator:
+    """ Exponential moving average of the time taken per item, used to size work to a latency budget. """
+    def __init__( self, smoothing=0.3 ):
+        self.smoothing = smoothing
+        self.per_item = None
+        self._lock = threading.Lock()
+
+    def add( self, elapsed, items=1 ):
+        with self._lock:
+            sample = elapsed / max(1, items)
+            if self.per_item is None:
+                self.per_item = sample
+            else:
+                self.per_item += self.smoothing * (sample - self.per_item)
+
+    def items_within( self, budget, limit ):
+        """ How many items ( at most `limit`, at least 1 ) are expected to fit in `budget` seconds. """
+        with self._lock:
+            if not self.per_item:
+                return limit
+            return max(1, min(limit, int(budget / self.per_item)))
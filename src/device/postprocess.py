@@ -0,0 +1,99 @@
+import numpy as np
+
+# Array based post-processing of the model output: per-class confidence thresholds, then every PPE box is assigned
+# to the person box that contains it, so each person is judged on their own equipment and one person's helmet
+# no longer covers someone else standing next to them.
+
+def parse_class_thresholds( spec ):
+    """ "helmet:0.4,person:0.5" -> { "helmet": 0.4, "person": 0.5 } """
+    thresholds = {}
+    for entry in filter(None, (spec or "").split(",")):
+        class_name, threshold = entry.rsplit(":", 1)
+        thresholds[class_name.strip()] = float(threshold)
+    return thresholds
+
+def class_threshold_array( names, class_thresholds, default=0.25 ):
+    """ Minimum confidence indexed by class id. """
+    thresholds = np.full(max(names) + 1, default, dtype=np.float32)
+    for class_id, class_name in names.items():
+        if class_name in class_thresholds:
+            thresholds[class_id] = class_thresholds[class_name]
+    return thresholds
+
+def detection_arrays( result, thresholds ):
+    """ ( xyxy [N, 4], confidence [N], class id [N] ) of the detections in an ultralytics result that pass their class threshold. """
+    boxes = result.boxes.cpu().numpy()
+    xyxy = boxes.xyxy.astype(np.float32).reshape(-1, 4)
+    confidences = boxes.conf.astype(np.float32).reshape(-1)
+    class_ids = boxes.cls.astype(np.int64).reshape(-1)
+    keep = confidences >= thresholds[class_ids]
+    return xyxy[keep], confidences[keep], class_ids[keep]
+
+def containment( outer_boxes, inner_boxes ):
+    """ [ outer, inner ] share of the area of every inner box that lies inside every outer box. """
+    x1 = np.maximum(outer_boxes[:, None, 0], inner_boxes[None, :, 0])
+    y1 = np.maximum(outer_boxes[:, None, 1], inner_boxes[None, :, 1])
+    x2 = np.minimum(outer_boxes[:, None, 2], inner_boxes[None, :, 2])
+    y2 = np.minimum(outer_boxes[:, None, 3], inner_boxes[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    inner_area = (inner_boxes[:, 2] - inner_boxes[:, 0]) * (inner_boxes[:, 3] - inner_boxes[:, 1])
+    return intersection / np.maximum(inner_area, 1e-6)[None, :]
+
+def assign_items( person_boxes, item_boxes, min_containment=0.5 ):
+    """ Index of the person each item belongs to, -1 for items not inside any person box. """
+    if len(person_boxes) == 0 or len(item_boxes) == 0:
+        return np.full(len(item_boxes), -1, dtype=np.int64)
+    shares = containment(person_boxes, item_boxes)
+    owners = shares.argmax(axis=0)
+    owners[shares.max(axis=0) < min_containment] = -1
+    return owners
+
+def associate_ppe( xyxy, confidences, class_ids, names, required_items, min_containment=0.5 ):
+    """
+        Judge every person in a frame on the required items inside their box.
+        Returns ( frame confidences, people ):
+            - frame confidences: { class name: confidence } used for burst voting. "person" is the most confident person,
+              a required item the lowest confidence among the people ( 0 if anyone lacks it ), so the frame only counts
+              an item as present when everyone has it. Without people, items fall back to their most confident box.
+            - people: one { "box", "confidence", "items", "missing" } per person box, most confident first.
+    """
+    class_ids_by_name = {class_name: class_id for class_id, class_name in names.items()}
+    person_mask = class_ids == class_ids_by_name.get("person", -1)
+    person_boxes = xyxy[person_mask]
+    person_confidences = confidences[person_mask]
+    item_names = [item for item in required_items if item != "person" and item in class_ids_by_name]
+    item_ids = np.array([class_ids_by_name[item] for item in item_names], dtype=np.int64)
+
+    # Which required item each box is, -1 for people and classes that are not required
+    item_columns = np.full(len(class_ids), -1, dtype=np.int64)
+    for column, item_id in enumerate(item_ids):
+        item_columns[class_ids == item_id] = column
+    item_mask = item_columns >= 0
+
+    # Best confidence of every required item on every person
+    item_confidences = np.zeros((len(person_boxes), len(item_names)), dtype=np.float32)
+    owners = assign_items(person_boxes, xyxy[item_mask], min_containment)
+    owned = owners >= 0
+    np.maximum.at(item_confidences, (owners[owned], item_columns[item_mask][owned]), confidences[item_mask][owned])
+
+    frame_confidences = {}
+    if len(person_boxes):
+        frame_confidences["person"] = float(person_confidences.max())
+        for column, item in enumerate(item_names):
+            frame_confidences[item] = float(item_confidences[:, column].min())
+    else:
+        for column, item in enumerate(item_names):
+            column_confidences = confidences[item_columns == column]
+            frame_confidences[item] = float(column_confidences.max()) if len(column_confidences) else 0.0
+    frame_confidences = {item: confidence for item, confidence in frame_confidences.items() if confidence > 0}
+
+    people = []
+    for index in np.argsort(-person_confidences):
+        items = {item: float(item_confidences[index, column]) for column, item in enumerate(item_names) if item_confidences[index, column] > 0}
+        people.append({
+            "box": person_boxes[index].tolist(),
+            "confidence": float(person_confidences[index]),
+            "items": items,
+            "missing": [item for item in required_items if item != "person" and item not in items]
+        })
+    return frame_confidences, people
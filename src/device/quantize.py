@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import queue
+import resource
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+from device.inference import (
+    load_model, export_model, artifact_path, export_stamp, write_stamp,
+    list_images, box_iou, detections_from_result
+)
+from device.vision import CROP_SIZE, model_input
+
+# Post-training static INT8 quantization of the ONNX export, calibrated on captured entry images.
+# The quantized model is loaded with INFERENCE_BACKEND=onnx_int8 through the same load_model path as every other backend.
+# Calibration and the report see the guide region crops the gate feeds the model ( vision.model_input ), not full frames,
+# so the INT8 ranges and the parity numbers come from the deployed input distribution.
+
+def letterbox( image, imgsz ):
+    """ Same pre-processing as ultralytics: resize keeping the aspect ratio, pad to a square with grey, RGB, CHW, 0-1. """
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    resized = cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_LINEAR)
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    padded[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+def quantize_model( checkpoint, calibration_dir, imgsz=640, max_images=300 ):
+    """ Quantize the ONNX export of `checkpoint` to INT8, calibrating on up to `max_images` images. Returns the artifact path. """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    image_paths = list_images(calibration_dir)[:max_images]
+    assert image_paths, f"No calibration images found in {calibration_dir}"
+    fp32_path = export_model(checkpoint, "onnx", imgsz)
+    int8_path = artifact_path(checkpoint, "onnx_int8")
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class FolderCalibrationReader( CalibrationDataReader ):
+        def __init__( self ):
+            self.image_paths = iter(image_paths)
+
+        def get_next( self ):
+            image_path = next(self.image_paths, None)
+            if image_path is None:
+                return None
+            return {input_name: letterbox(model_input(cv2.imread(image_path))[0], imgsz)}
+
+    print(f"Calibrating INT8 model on {len(image_paths)} images...")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        FolderCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True
+    )
+
+    # Ultralytics reads class names and the input size from the model metadata, keep them on the quantized model
+    fp32_model = onnx.load(fp32_path)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+    write_stamp(int8_path, {
+        **export_stamp(checkpoint, "onnx_int8", imgsz),
+        "calibration_dir": os.path.abspath(calibration_dir),
+        "calibration_images": len(image_paths)
+    })
+    return int8_path
+
+# --- Accuracy / latency report ---
+def read_labels( label_dir, image_path, image_shape, names, crop=None, min_visible=0.5 ):
+    """
+        Ground truth from a YOLO format label file ( class cx cy w h, normalized ), None if there is none.
+        With `crop` from vision.model_input the boxes are mapped onto the model input, boxes with less than
+        `min_visible` of their area inside the guide region are dropped.
+    """
+    label_path = os.path.join(label_dir, os.path.splitext(os.path.basename(image_path))[0] + ".txt")
+    if not os.path.exists(label_path):
+        return None
+    h, w = image_shape[:2]
+    labels = []
+    with open(label_path) as label_file:
+        for line in label_file:
+            if not line.strip():
+                continue
+            cls_id, cx, cy, bw, bh = line.split()[:5]
+            cx, cy, bw, bh = float(cx) * w, float(cy) * h, float(bw) * w, float(bh) * h
+            box = [cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2]
+            if crop is not None:
+                x1, y1, scale_x, scale_y = crop
+                box = [(box[0] - x1) * scale_x, (box[1] - y1) * scale_y, (box[2] - x1) * scale_x, (box[3] - y1) * scale_y]
+                area = (box[2] - box[0]) * (box[3] - box[1])
+                box = [min(max(value, 0.0), float(CROP_SIZE)) for value in box]
+                if area <= 0 or (box[2] - box[0]) * (box[3] - box[1]) < min_visible * area:
+                    continue
+            labels.append((names[int(cls_id)], box))
+    return labels
+
+def average_precision( detections, ground_truth, class_name, iou_threshold=0.5 ):
+    """ All-point interpolated AP@iou_threshold of one class, from per-image detections and ground truth. """
+    scored = []
+    truth_count = 0
+    for image_detections, image_truth in zip(detections, ground_truth):
+        truth_boxes = [box for name, box in image_truth if name == class_name]
+        truth_count += len(truth_boxes)
+        for name, confidence, box in image_detections:
+            if name == class_name:
+                scored.append((confidence, box, truth_boxes))
+    if truth_count == 0:
+        return None
+    scored.sort(key=lambda item: -item[0])
+    matched_boxes = set()
+    true_positives = []
+    for _, box, truth_boxes in scored:
+        best_index, best_iou = None, iou_threshold
+        for index, truth_box in enumerate(truth_boxes):
+            iou = box_iou(box, truth_box)
+            if id(truth_box) not in matched_boxes and iou >= best_iou:
+                best_index, best_iou = index, iou
+        if best_index is None:
+            true_positives.append(0)
+        else:
+            matched_boxes.add(id(truth_boxes[best_index]))
+            true_positives.append(1)
+
+    cumulative_tp = np.cumsum(true_positives)
+    recall = np.concatenate([[0.0], cumulative_tp / truth_count, [1.0]])
+    precision = np.concatenate([[1.0], cumulative_tp / np.arange(1, len(true_positives) + 1), [0.0]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return float(np.sum((recall[1:] - recall[:-1]) * precision[1:]))
+
+def class_recall( detections, ground_truth, class_name, min_confidence=0.25, iou_threshold=0.5 ):
+    """ Share of ground truth boxes of one class found at the deployment confidence threshold. """
+    found = total = 0
+    for image_detections, image_truth in zip(detections, ground_truth):
+        candidates = [box for name, confidence, box in image_detections if name == class_name and confidence >= min_confidence]
+        for name, truth_box in image_truth:
+            if name != class_name:
+                continue
+            total += 1
+            if any(box_iou(truth_box, box) >= iou_threshold for box in candidates):
+                found += 1
+    return found / total if total else None
+
+def _profile_model( checkpoint, backend, imgsz, image_paths, results ):
+    """ Runs in a fresh process so resident memory is measured per model. """
+    model = load_model(checkpoint, backend, imgsz)
+    images = [model_input(cv2.imread(image_path))[0] for image_path in image_paths]
+    model(images[0])  # Warm-up, not timed
+    latencies = []
+    detections = []
+    for image in images:
+        start = time.perf_counter()
+        result = model(image, conf=0.001)[0]
+        latencies.append(time.perf_counter() - start)
+        detections.append(detections_from_result(result, model.names))
+    results.put({
+        "names": dict(model.names),
+        "detections": detections,
+        "latencies": latencies,
+        # Linux reports the peak resident set size in kilobytes
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+def profile_model( checkpoint, backend, imgsz, image_paths ):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_profile_model, args=(checkpoint, backend, imgsz, image_paths, results))
+    process.start()
+    # A child that crashes ( out of memory, backend import error ) never puts a result, so poll instead of waiting forever
+    while True:
+        try:
+            profile = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            try:
+                # It may have put its result right before exiting
+                profile = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                raise RuntimeError(f"Profiling the {backend} model failed, its process exited with code {process.exitcode}")
+    process.join()
+    return profile
+
+def quantization_report( checkpoint, image_dir, required_items, imgsz=640, label_dir=None, baseline="pytorch" ):
+    """
+        Compare the INT8 model against the FP32 `baseline` on a folder of images.
+        With YOLO format labels in `label_dir`, both are scored against them. Without labels the FP32
+        detections ( confidence >= 0.25 ) are the reference, so the INT8 numbers measure agreement with FP32.
+    """
+    image_paths = list_images(image_dir)
+    assert image_paths, f"No images found in {image_dir}"
+    profiles = {
+        "fp32": profile_model(checkpoint, baseline, imgsz, image_paths),
+        "int8": profile_model(checkpoint, "onnx_int8", imgsz, image_paths)
+    }
+    names = profiles["fp32"]["names"]
+    assert names == profiles["int8"]["names"], "Class names differ between the FP32 and INT8 models"
+
+    if label_dir:
+        ground_truth = []
+        for image_path in image_paths:
+            image = cv2.imread(image_path)
+            labels = read_labels(label_dir, image_path, image.shape, names, model_input(image)[1])
+            ground_truth.append(labels or [])
+    else:
+        ground_truth = [
+            [(name, box) for name, confidence, box in image_detections if confidence >= 0.25]
+            for image_detections in profiles["fp32"]["detections"]
+        ]
+
+    report = {
+        "reference": "labels" if label_dir else "fp32 detections",
+        "images": len(image_paths),
+        "imgsz": imgsz
+    }
+    for precision_name, profile in profiles.items():
+        class_aps = [
+            average_precision(profile["detections"], ground_truth, class_name)
+            for class_name in names.values()
+        ]
+        class_aps = [ap for ap in class_aps if ap is not None]
+        latencies_ms = np.array(profile["latencies"]) * 1000
+        report[precision_name] = {
+            "map50": float(np.mean(class_aps)) if class_aps else None,
+            "required_item_recall": {
+                item: class_recall(profile["detections"], ground_truth, item)
+                for item in required_items
+            },
+            "latency_ms": {
+                "mean": float(latencies_ms.mean()),
+                "p50": float(np.percentile(latencies_ms, 50)),
+                "p95": float(np.percentile(latencies_ms, 95))
+            },
+            "max_rss_mb": profile["max_rss_mb"]
+        }
+    report["speedup"] = report["fp32"]["latency_ms"]["mean"] / report["int8"]["latency_ms"]["mean"]
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the detector to INT8 and compare it against FP32.")
+    parser.add_argument("--checkpoint", default="checkpoints/yolo10s_trained1.pt")
+    parser.add_argument("--images", required=True, help="Folder of captured entry images used for calibration")
+    parser.add_argument("--eval-images", help="Folder of images for the report, defaults to the calibration images")
+    parser.add_argument("--labels", help="Folder of YOLO format labels for the report images")
+    parser.add_argument("--required-items", default="person,helmet", help="Comma separated items to report recall for")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--max-images", type=int, default=300)
+    parser.add_argument("--baseline", default="pytorch", help="FP32 backend to compare against")
+    parser.add_argument("--report", default="quantization_report.json")
+    parser.add_argument("--skip-quantize", action="store_true", help="Only write the report for an existing INT8 model")
+    args = parser.parse_args()
+
+    if not args.skip_quantize:
+        print(f"INT8 model written to {quantize_model(args.checkpoint, args.images, args.imgsz, args.max_images)}")
+    report = quantization_report(
+        args.checkpoint,
+        args.eval_images or args.images,
+        args.required_items.split(","),
+        args.imgsz,
+        args.labels,
+        args.baseline
+    )
+    with open(args.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(json.dumps(report, indent=2))
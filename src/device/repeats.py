@@ -0,0 +1,36 @@
+import cv2
+
+# Perceptual hashing of the annotated crop, so a worker who lingers in front of the gate or re-triggers the sensor
+# is recognised as the same scene even though the pixels ( and so the SHA-256 ) differ from capture to capture.
+
+def dhash( image, hash_size=8 ):
+    """ Difference hash: 64 bits of "is this pixel brighter than its right neighbour" on a tiny greyscale copy, as 16 hex digits. """
+    grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(grey, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{len(bits) // 4}x}"
+
+def hamming( perceptual_hash, other_hash ):
+    """ Number of differing bits between two hashes from dhash. """
+    return bin(int(perceptual_hash, 16) ^ int(other_hash, 16)).count("1")
+
+class RepeatFilter:
+    """
+        Remembers the captures of one gate for `window` seconds. A capture is a repeat when a remembered capture with the
+        same missing items is at most `max_distance` bits away. Repeats extend the window of the capture they match,
+        so someone standing at the gate for minutes stays one event.
+    """
+    def __init__( self, max_distance=6, window=120 ):
+        self.max_distance = max_distance
+        self.window = window
+        self._recent = []  # [ perceptual hash, missing items, last seen ]
+
+    def check( self, perceptual_hash, missing, captured_at ):
+        """ Returns True if the capture repeats a recent one, and remembers it either way. """
+        self._recent = [entry for entry in self._recent if captured_at - entry[2] <= self.window]
+        for entry in self._recent:
+            if entry[1] == sorted(missing) and hamming(entry[0], perceptual_hash) <= self.max_distance:
+                entry[2] = captured_at
+                return True
+        self._recent.append([perceptual_hash, sorted(missing), captured_at])
+        return False
@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from device.metrics import SCHEDULER_BATCH_IMAGES, SCHEDULER_WAIT_SECONDS
+
+class InferenceScheduler:
+    """
+        Serves one loaded model to several gates.
+        Requests from all gates are merged into a single batched forward pass. Gates are served round-robin,
+        one request per gate per round, so a gate with a backlog cannot starve a quieter neighbour: every gate
+        with a waiting request is in the next batch unless the batch is full, in which case it is first in the one after.
+        A burst is never split across batches; a burst larger than `max_batch` runs on its own.
+    """
+    def __init__( self, model, max_batch=8, max_wait=0.01 ):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+
+    @property
+    def names( self ):
+        return self.model.names
+
+    def start( self ):
+        self._thread.start()
+
+    def stop( self, timeout=None ):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def for_gate( self, gate_name ):
+        """ A model-like callable that routes the images of `gate_name` through the scheduler. """
+        with self._condition:
+            self._queues.setdefault(gate_name, deque())
+        return GateModel(self, gate_name)
+
+    def submit( self, gate_name, images ):
+        future = Future()
+        with self._condition:
+            self._queues[gate_name].append((images, future, time.perf_counter()))
+            self._condition.notify_all()
+        return future
+
+    def _pending_images( self ):
+        return sum(len(images) for requests in self._queues.values() for images, _, _ in requests)
+
+    def _next_batch( self ):
+        """ Take requests round-robin across gates until the batch is full. Called with the condition held. """
+        batch = []
+        batch_images = 0
+        while True:
+            took_any = False
+            for gate_name in list(self._queues):
+                requests = self._queues[gate_name]
+                if not requests:
+                    continue
+                request_images = len(requests[0][0])
+                if batch and batch_images + request_images > self.max_batch:
+                    continue
+                batch.append((gate_name, requests.popleft()))
+                batch_images += request_images
+                took_any = True
+                # The gate served last goes to the back of the order, so the next batch starts with the others
+                self._queues.move_to_end(gate_name)
+                if batch_images >= self.max_batch:
+                    return batch
+            if not took_any:
+                return batch
+
+    def _run( self ):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopping or self._pending_images() > 0)
+                if self._stopping and self._pending_images() == 0:
+                    return
+                # Give the other gates a moment to join the batch
+                deadline = time.perf_counter() + self.max_wait
+                while self._pending_images() < self.max_batch and not self._stopping:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._next_batch()
+
+            started = time.perf_counter()
+            images = [image for _, (request_images, _, _) in batch for image in request_images]
+            for gate_name, (_, _, queued_at) in batch:
+                SCHEDULER_WAIT_SECONDS.labels(gate_name).observe(started - queued_at)
+            SCHEDULER_BATCH_IMAGES.observe(len(images))
+            try:
+                results = self.model(images)
+            except Exception as e:
+                for _, (_, future, _) in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            offset = 0
+            for _, (request_images, future, _) in batch:
+                future.set_result(results[offset:offset + len(request_images)])
+                offset += len(request_images)
+
+class GateModel:
+    """ Stands in for the model in run_inference, blocking until the scheduler has run the gate's images. """
+    def __init__( self, scheduler, gate_name ):
+        self.scheduler = scheduler
+        self.gate_name = gate_name
+
+    @property
+    def names( self ):
+        return self.scheduler.names
+
+    def __call__( self, images ):
+        if not isinstance(images, list):
+            images = [images]
+        return self.scheduler.submit(self.gate_name, images).result()
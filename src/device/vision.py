@@ -0,0 +1,177 @@
+import cv2
+import time
+import zstd
+import hashlib
+import numpy as np
+from contextlib import contextmanager
+from device.postprocess import class_threshold_array, detection_arrays, associate_ppe
+
+# Crop and annotation steps of the gate, shared by the live loop in main.py and the offline benchmark.
+# Every step can record its duration into a `timings` dict ( step name -> seconds ) when one is passed in.
+
+CROP_SIZE = 320  # The guide region crop is resized to this square before it is fed to the model
+GUIDE_BOX_SIZE = (200, 400)  # Width and height of the "Stand Here" box in the middle of the frame
+
+@contextmanager
+def timed( timings, step ):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[step] = timings.get(step, 0.0) + time.perf_counter() - start
+
+def guide_box( frame ):
+    h, w, _ = frame.shape
+    box_width, box_height = GUIDE_BOX_SIZE
+    top_left = (w // 2 - box_width // 2, h // 2 - box_height // 2)
+    bottom_right = (w // 2 + box_width // 2, h // 2 + box_height // 2)
+    return top_left, bottom_right
+
+# Overlay function to show guide and countdown
+def show_guide( frame, elapsed, countdown_seconds ):
+    h, w, _ = frame.shape
+    top_left, bottom_right = guide_box(frame)
+    overlay = frame.copy()
+    cv2.rectangle(overlay, top_left, bottom_right, (0, 255, 0), 2)
+    countdown = max(0, int(countdown_seconds - elapsed) + 1)
+    cv2.putText(overlay, "Stand Here", (top_left[0], top_left[1] - 10),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    cv2.putText(overlay, f"Photo in: {countdown}s", (w - 250, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+    return overlay, top_left, bottom_right
+
+def guide_region_bounds( frame, top_left, bottom_right ):
+    """ ( x1, y1, x2, y2 ) of the guide box plus 30% padding on every side, clipped to the frame. """
+    h, w, _ = frame.shape
+    box_width = bottom_right[0] - top_left[0]
+    box_height = bottom_right[1] - top_left[1]
+
+    padding_x = int(box_width * 0.3)
+    padding_y = int(box_height * 0.3)
+    roi_x1 = max(0, top_left[0] - padding_x)
+    roi_y1 = max(0, top_left[1] - padding_y)
+    roi_x2 = min(w, bottom_right[0] + padding_x)
+    roi_y2 = min(h, bottom_right[1] + padding_y)
+    return roi_x1, roi_y1, roi_x2, roi_y2
+
+def crop_guide_region( frame, top_left, bottom_right ):
+    roi_x1, roi_y1, roi_x2, roi_y2 = guide_region_bounds(frame, top_left, bottom_right)
+    return frame[roi_y1:roi_y2, roi_x1:roi_x2]
+
+def model_input( frame ):
+    """
+        The guide region of a full frame resized to CROP_SIZE, exactly as the gate feeds it to the model, for
+        offline tools. Also returns the crop's ( x1, y1, x scale, y scale ) to map frame coordinates onto the input.
+    """
+    x1, y1, x2, y2 = guide_region_bounds(frame, *guide_box(frame))
+    resized = cv2.resize(frame[y1:y2, x1:x2], (CROP_SIZE, CROP_SIZE))
+    return resized, (x1, y1, CROP_SIZE / (x2 - x1), CROP_SIZE / (y2 - y1))
+
+# Decide which classes are present across a burst, from the highest confidence of each class in every frame
+def vote_detections( frame_confidences, voting="majority", min_confidence=0.35 ):
+    detected_classes = set()
+    for class_name in set().union(*frame_confidences):
+        confidences = [confidences.get(class_name, 0.0) for confidences in frame_confidences]
+        if voting == "confidence":
+            present = sum(confidences) / len(confidences) >= min_confidence
+        else:
+            # Present in at least half the frames, so one occluded or blurred frame does not raise a violation
+            present = sum(1 for confidence in confidences if confidence > 0) * 2 >= len(confidences)
+        if present:
+            detected_classes.add(class_name)
+    return detected_classes
+
+# Accepts a single frame or a burst of frames, all crops go through the model in one batched call.
+# Returns the annotated evidence crop, the items missing at the gate and the people of the evidence frame,
+# each with their box ( crop coordinates ) and their own missing items.
+def run_inference( model, frames, top_left, bottom_right, required_items, show_bounding_boxes=False,
+                   voting="majority", min_confidence=0.35, class_thresholds=None, min_containment=0.5, timings=None ):
+    if not isinstance(frames, list):
+        frames = [frames]
+    with timed(timings, "crop_resize"):
+        cropped_frames = [crop_guide_region(frame, top_left, bottom_right) for frame in frames]
+        resized_frames = [cv2.resize(cropped_frame, (CROP_SIZE, CROP_SIZE)) for cropped_frame in cropped_frames]
+
+    with timed(timings, "forward"):
+        results = model(resized_frames)
+
+    with timed(timings, "postprocess"):
+        names = model.names
+        thresholds = class_threshold_array(names, class_thresholds or {})
+        frame_detections = [detection_arrays(result, thresholds) for result in results]
+        frame_confidences = []
+        frame_people = []
+        for xyxy, confidences, class_ids in frame_detections:
+            confidences_by_class, people = associate_ppe(xyxy, confidences, class_ids, names, required_items, min_containment)
+            frame_confidences.append(confidences_by_class)
+            frame_people.append(people)
+        detected_classes = vote_detections(frame_confidences, voting, min_confidence)
+
+        # Use the frame that agrees best with the vote as evidence, the latest one on ties
+        best_index = min(
+            range(len(frames)),
+            key=lambda index: (len(detected_classes.symmetric_difference(frame_confidences[index])), -index)
+        )
+        cropped_frame = cropped_frames[best_index]
+
+        # Scale boxes back from the model input to the crop
+        scale = np.array([cropped_frame.shape[1], cropped_frame.shape[0]] * 2, dtype=np.float32) / CROP_SIZE
+        people = frame_people[best_index]
+        for person in people:
+            person["box"] = (np.array(person["box"]) * scale).astype(int).tolist()
+
+    with timed(timings, "annotate"):
+        # Copy the original cropped frame for annotation
+        annotated_crop = cropped_frame.copy()
+
+        # Draw bounding boxes if enabled, people in green or red depending on their own equipment
+        if show_bounding_boxes:
+            xyxy, _, class_ids = frame_detections[best_index]
+            for (x1, y1, x2, y2), class_id in zip((xyxy * scale).astype(int).tolist(), class_ids.tolist()):
+                if names[class_id] == "person":
+                    continue
+                cv2.rectangle(annotated_crop, (x1, y1), (x2, y2), (255, 255, 0), 2)
+                cv2.putText(annotated_crop, names[class_id], (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+            for person in people:
+                x1, y1, x2, y2 = person["box"]
+                color = (0, 0, 255) if person["missing"] else (0, 255, 0)
+                cv2.rectangle(annotated_crop, (x1, y1), (x2, y2), color, 2)
+                label = f"missing: {', '.join(person['missing'])}" if person["missing"] else "person"
+                cv2.putText(annotated_crop, label, (x1, max(15, y2 - 10)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+        # Checklist overlay
+        checklist_x, checklist_y = 10, 30
+        for item in required_items:
+            color = (0, 255, 0) if item in detected_classes else (0, 0, 255)
+            cv2.putText(annotated_crop, item, (checklist_x, checklist_y),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            checklist_y += 30
+
+    missing_items = [item for item in required_items if item not in detected_classes]
+    return annotated_crop, missing_items, people
+
+# Evidence image formats: content type, file extension for cv2.imencode and the quality flag ( None for lossless PNG )
+IMAGE_FORMATS = {
+    "png": ("image/png", ".png", None),
+    "jpeg": ("image/jpeg", ".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": ("image/webp", ".webp", cv2.IMWRITE_WEBP_QUALITY)
+}
+
+# Encode the annotated crop as `image_format` at `quality` ( 1-100, ignored by PNG ), downscaled by `scale` first.
+# Returns the image ( zstd compressed if `compress` ), the hash of the uncompressed image and its content type.
+# zstd only pays off for PNG, JPEG and WebP are already entropy coded.
+def encode_image( annotated, timings=None, image_format="png", quality=85, scale=1.0, compress=True ):
+    content_type, extension, quality_flag = IMAGE_FORMATS[image_format]
+    with timed(timings, "encode"):
+        if scale < 1:
+            annotated = cv2.resize(annotated, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode(extension, annotated, [quality_flag, int(quality)] if quality_flag is not None else [])
+        image_hash = hashlib.sha256(buffer).hexdigest()
+    if not compress:
+        return buffer.tobytes(), image_hash, content_type
+    with timed(timings, "zstd"):
+        image_data = zstd.compress(buffer)
+    return image_data, image_hash, content_type
@@ -1,190 +1,387 @@
-import cv2
 import time
+STARTED_AT = time.perf_counter()  # Start of the startup timing breakdown, before any heavy import
+
+import cv2
 import os
-import asyncio
-import requests
+import json
 import zstd
-import base64
-import hashlib
-from ultralytics import YOLO
-from gpiozero import DistanceSensor
-from telegram import Bot
+import resource
+import threading
 from dotenv import load_dotenv
 from config import Config
+from device.pipeline import Stage, Pipeline, ThroughputMeter, LatencyEstimator
+from device.outbox import Outbox
+from device.alerts import AlertDispatcher
+from device.repeats import RepeatFilter, dhash
+from device.inference import load_model
+from device.vision import timed, show_guide, run_inference, encode_image
+from device.postprocess import parse_class_thresholds
+from device.hardware import open_camera, open_presence_sensor
+from device.gating import PresenceGate, open_trigger
+from device.scheduler import InferenceScheduler
+from device.metrics import CAPTURES, REPEAT_CAPTURES, CAMERA_READ_FAILURES, TRIGGERS_REJECTED, record_timings, start_exporter
 
 # --- Load environment and Variable Setup ---
 web_config = Config()
 load_dotenv()
-bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"))
-chat_id = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")  # Alerts are skipped without a token, e.g. in soak runs
+TELEGRAM_CHAT_IDS = [chat_id.strip() for chat_id in (os.getenv("TELEGRAM_CHAT_ID") or "").split(",") if chat_id.strip()]  # Comma separated to alert several chats
 device_name = os.getenv("DEVICE_NAME") or "Unnamed Device"
 external_server_url = os.getenv("SERVER_URL") or "http://127.0.0.1:5000"
 external_server_api_key = os.getenv("SERVER_API_KEY") or "5a2a68a8-8f1f-443d-a69e-578e5583b922"
 S3_REGION = web_config.S3_REGION
 S3_BUCKET = web_config.S3_BUCKET
 
-# Set up asyncio event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-
 # --- YOLO model and constants ---
-model = YOLO("checkpoints/yolo10s_trained1.pt")
+MODEL_CHECKPOINT = os.getenv("MODEL_CHECKPOINT") or "checkpoints/yolo10s_trained1.pt"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND") or "pytorch"  # pytorch / onnx / openvino / ncnn, exported once and cached next to the checkpoint
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE") or 640)  # Model input size, 320 matches the crop size and is about 4x cheaper
 required_items = ["person", "helmet"] # Edit this list to add/remove required items
 
-# --- Camera ---
-cap = cv2.VideoCapture(0)
-
-# --- Ultrasonic Sensor ---
-US = DistanceSensor(echo=4, trigger=17)
-US.threshold_distance = 0.75
-US.max_distance = 2
-
 # --- Constants ---
 SHOW_BOUNDING_BOXES = False  # Toggle this between True/False to show/hide bounding boxes
+COUNTDOWN_SECONDS = float(os.getenv("COUNTDOWN_SECONDS") or 5)  # Time given to the person to stand in the guide box
+COOLDOWN_SECONDS = float(os.getenv("COOLDOWN_SECONDS") or 5)  # Time the result is shown before the gate re-arms
+CAMERA_SOURCE = os.getenv("CAMERA_SOURCE") or "0"  # Camera index, or a folder of images / video file to replay instead
+CAMERA_FPS = float(os.getenv("CAMERA_FPS") or 0)  # Camera frame rate, or the pace of replayed frames ( 0 for as fast as the gate reads them )
+CAMERA_WIDTH = int(os.getenv("CAMERA_WIDTH") or 640)  # Capture resolution, the guide box crop is only 320x320 so more is wasted decoding
+CAMERA_HEIGHT = int(os.getenv("CAMERA_HEIGHT") or 480)
+CAMERA_FOURCC = os.getenv("CAMERA_FOURCC") or "MJPG"  # Pixel format requested from the camera
+CAMERA_GRABBER = (os.getenv("CAMERA_GRABBER") or "true").lower() == "true"  # Drain the camera on a background thread so frames are never stale
+PRESENCE_SENSOR = os.getenv("PRESENCE_SENSOR") or "ultrasonic"  # ultrasonic / scripted ( no GPIO needed )
+SENSOR_SCRIPT = os.getenv("SENSOR_SCRIPT") or "2.0:1,0.5:10"  # Scripted sensor: looping distance:seconds steps
+SENSOR_THRESHOLD_DISTANCE = float(os.getenv("SENSOR_THRESHOLD_DISTANCE") or 0.75)  # Distance in meters someone must be within to trigger capture
+SENSOR_MAX_DISTANCE = float(os.getenv("SENSOR_MAX_DISTANCE") or 2)  # Range of the ultrasonic sensor in meters
+TRIGGER_MODE = os.getenv("TRIGGER_MODE") or "ultrasonic"  # ultrasonic / camera ( guide box check only ) / fused ( sensor confirmed by the camera )
+GATE_MIN_FILL = float(os.getenv("GATE_MIN_FILL") or 0.15)  # Share of the guide region that must differ from the empty background
+GATE_USE_HOG = (os.getenv("GATE_USE_HOG") or "false").lower() == "true"  # Also require a HOG person detection in the guide region
+GATE_RESEED_SECONDS = float(os.getenv("GATE_RESEED_SECONDS") or 60)  # Camera trigger: seconds the guide box may read occupied before the scene becomes the background, 0 never
+GATE_CONFIRM_FRAMES = int(os.getenv("GATE_CONFIRM_FRAMES") or 3)  # Consecutive occupied frames needed to trigger
+HEADLESS = (os.getenv("HEADLESS") or "false").lower() == "true"  # Run without OpenCV windows
+SOAK_CAPTURES = int(os.getenv("SOAK_CAPTURES") or 0)  # Stop after this many captures and print a summary, 0 to run forever
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 9101)  # Port of the local Prometheus exporter, 0 to disable
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE") or 4)  # Max events waiting at each pipeline stage
+PIPELINE_BACKPRESSURE = os.getenv("PIPELINE_BACKPRESSURE") or "block"  # block / drop_oldest / drop_newest
+OUTBOX_PATH = os.getenv("OUTBOX_PATH") or "spool/outbox.db"  # Local spool for events waiting to be uploaded
+OUTBOX_MAX_MB = int(os.getenv("OUTBOX_MAX_MB") or 256)  # Disk budget for the spool, oldest unflagged events are evicted first
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or 20)  # Events drained per flush
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT") or "multipart"  # multipart ( binary images ) / json ( base64 images, for older servers )
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT") or "jpeg"  # Evidence image format: jpeg / webp / png
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY") or 85)  # JPEG / WebP quality, 1-100
+IMAGE_SCALE = float(os.getenv("IMAGE_SCALE") or 1.0)  # Downscale the evidence crop by this factor before encoding
+IMAGE_ZSTD = (os.getenv("IMAGE_ZSTD") or str(IMAGE_FORMAT == "png")).lower() == "true"  # zstd compress the encoded image, only worth it for PNG
+BURST_FRAMES = int(os.getenv("BURST_FRAMES") or 3)  # Frames judged together at the end of the countdown, 1 for a single frame
+BURST_SPAN = float(os.getenv("BURST_SPAN") or 0.6)  # Seconds before the deadline the burst is spread over, one frame every BURST_SPAN / BURST_FRAMES
+BURST_VOTING = os.getenv("BURST_VOTING") or "majority"  # majority ( class seen in at least half the frames ) / confidence ( mean confidence )
+BURST_MIN_CONFIDENCE = float(os.getenv("BURST_MIN_CONFIDENCE") or 0.35)  # Mean confidence needed with confidence voting
+BURST_LATENCY_BUDGET = float(os.getenv("BURST_LATENCY_BUDGET") or 1.5)  # Seconds the batched inference may take, the burst shrinks to fit
+CLASS_THRESHOLDS = parse_class_thresholds(os.getenv("CLASS_THRESHOLDS"))  # Per-class minimum confidence, e.g. "helmet:0.4,person:0.5", others 0.25
+PPE_MIN_CONTAINMENT = float(os.getenv("PPE_MIN_CONTAINMENT") or 0.5)  # Share of a PPE box that must lie inside a person box to count as theirs
+GATES_FILE = os.getenv("GATES_FILE")  # JSON list of gates when one device serves several entry points, see README
+SCHEDULER_MAX_BATCH = int(os.getenv("SCHEDULER_MAX_BATCH") or 8)  # Most images in one forward pass of the shared model
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT") or 0.01)  # Seconds the model waits for other gates to join a batch
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE") or 50)  # Alerts waiting to be sent, the oldest is dropped when full
+ALERT_MIN_INTERVAL = float(os.getenv("ALERT_MIN_INTERVAL") or 1.0)  # Seconds between messages to one chat, Telegram throttles faster senders
+ALERT_COALESCE_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS") or 60)  # Further violations of a gate within this window are sent as one summary
+ALERT_ATTACH_IMAGE = (os.getenv("ALERT_ATTACH_IMAGE") or "true").lower() == "true"  # Attach the evidence image instead of only linking to S3
+REPEAT_WINDOW = float(os.getenv("REPEAT_WINDOW") or 120)  # Seconds a capture is remembered to recognise repeats of it, 0 to disable
+REPEAT_MAX_DISTANCE = int(os.getenv("REPEAT_MAX_DISTANCE") or 6)  # Most differing bits ( of 64 ) between the perceptual hashes of a repeat
 
-# Push notification to Telegram
-def telegram_message(message):
-    print("Sending Alert to Telegram: ", message)
-    loop.run_until_complete(bot.send_message(chat_id=chat_id, text=message))
+# Push notifications to Telegram, sent in the background by the dispatcher's own event loop
+alerts = AlertDispatcher(
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_IDS,
+    max_queue=ALERT_QUEUE_SIZE,
+    min_interval=ALERT_MIN_INTERVAL,
+    coalesce_window=ALERT_COALESCE_SECONDS
+)
 
-# Upload event to external server
-def upload_event(image_data, flagged, device_name):
-    try:
-        upload_req = requests.post(
-            f"{external_server_url}/api/log_event",
-            headers={"Authorization": external_server_api_key},
-            json={
-                "image": image_data,
-                "flagged": flagged,
-                "device_name": device_name
-            }
+# Spool event for upload to external server, the outbox flushes it in the background
+def upload_event(image_data, flagged, device_name, created_at=None, image_hash=None, content_type="image/png", compressed=True,
+                 perceptual_hash=None, repeat=False):
+    spool_id = outbox.put(image_data, flagged, device_name, created_at, image_hash, content_type, compressed, perceptual_hash, repeat)
+    print(f"Event spooled for upload with local ID: {spool_id}")
+    return spool_id
+
+# --- Outbox ---
+outbox = Outbox(
+    OUTBOX_PATH,
+    external_server_url,
+    external_server_api_key,
+    max_bytes=OUTBOX_MAX_MB * 1024 * 1024,
+    batch_size=OUTBOX_BATCH_SIZE,
+    upload_format=UPLOAD_FORMAT
+)
+
+# --- Gates ---
+# Loads the gates from GATES_FILE, or a single gate from the settings above. Keys missing from a gate fall back to those settings.
+def load_gate_configs():
+    defaults = {
+        "device_name": device_name,
+        "camera": CAMERA_SOURCE,
+        "presence_sensor": PRESENCE_SENSOR,
+        "sensor_script": SENSOR_SCRIPT,
+        "threshold_distance": SENSOR_THRESHOLD_DISTANCE,
+        "max_distance": SENSOR_MAX_DISTANCE,
+        "echo": 4,
+        "trigger": 17,
+        "trigger_mode": TRIGGER_MODE,
+        "required_items": required_items
+    }
+    if not GATES_FILE:
+        return [defaults]
+    with open(GATES_FILE) as gates_file:
+        gate_configs = [{**defaults, **gate_config} for gate_config in json.load(gates_file)]
+    for gate_config in gate_configs:
+        # "camera": 0 is as natural in JSON as "0"
+        gate_config["camera"] = str(gate_config["camera"])
+    gate_names = [gate_config["device_name"] for gate_config in gate_configs]
+    assert gate_configs and len(set(gate_names)) == len(gate_names), "Gates must have unique device names"
+    return gate_configs
+
+class Gate:
+    """
+        One entry point: a camera, a presence trigger and its own pipeline, with the capture loop on its own thread.
+        Gates share the model ( through the inference scheduler ), the outbox and the alert dispatcher.
+        Capture runs on the gate thread, everything after it on the pipeline's worker threads, so the next person
+        can be screened while the previous event is still being encoded and uploaded.
+    """
+    def __init__(self, config, model, stopping):
+        self.name = config["device_name"]
+        self.config = config
+        self.required_items = config["required_items"]
+        self.model = model
+        self.stopping = stopping
+        self.throughput = ThroughputMeter()
+        self.inference_latency = LatencyEstimator()
+        self.captures = 0
+        self.repeats = RepeatFilter(REPEAT_MAX_DISTANCE, REPEAT_WINDOW)
+        self.display = None  # Newest frame to show, the main thread puts it in the gate's window
+        self.cap = self.trigger = self.presence_gate = None
+        self.pipeline = Pipeline([
+            Stage("inference", self.inference_stage, PIPELINE_QUEUE_SIZE, PIPELINE_BACKPRESSURE),
+            Stage("encode", self.encode_stage, PIPELINE_QUEUE_SIZE, PIPELINE_BACKPRESSURE),
+            Stage("delivery", self.delivery_stage, PIPELINE_QUEUE_SIZE, PIPELINE_BACKPRESSURE)
+        ])
+        self.thread = threading.Thread(target=self.run, name=f"gate-{self.name}", daemon=True)
+
+    # Hardware is only opened when the gate runs, so the module can be imported without a camera or GPIO
+    def open_camera(self):
+        self.cap = open_camera(self.config["camera"], CAMERA_FPS, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FOURCC, CAMERA_GRABBER)
+
+    def open_trigger(self):
+        trigger_mode = self.config["trigger_mode"]
+        self.presence_gate = PresenceGate(GATE_MIN_FILL, GATE_USE_HOG, reseed_after=GATE_RESEED_SECONDS) if trigger_mode != "ultrasonic" else None
+        self.trigger = open_trigger(
+            trigger_mode,
+            lambda: open_presence_sensor(
+                self.config["presence_sensor"], self.config["sensor_script"],
+                threshold_distance=self.config["threshold_distance"], max_distance=self.config["max_distance"],
+                echo=self.config["echo"], trigger=self.config["trigger"]
+            ),
+            self.cap,
+            self.presence_gate,
+            GATE_CONFIRM_FRAMES
         )
-        if upload_req.status_code != 200:
-            print(f"Error uploading event: {upload_req.status_code}, {upload_req.text}")
-            return False
-        json_response = upload_req.json()
-        event_id = json_response["event_id"]
-        print(f"Event logged successfully with ID: {event_id}")
+
+    # --- Pipeline stages ---
+    def inference_stage(self, event):
+        timings = {}
+        annotated, missing, people = run_inference(
+            self.model, event["frames"], event["top_left"], event["bottom_right"], self.required_items,
+            SHOW_BOUNDING_BOXES, BURST_VOTING, BURST_MIN_CONFIDENCE, CLASS_THRESHOLDS, PPE_MIN_CONTAINMENT, timings
+        )
+        self.inference_latency.add(timings["forward"], len(event["frames"]))
+        record_timings(timings)
+        self.display = annotated
+        return {"annotated": annotated, "missing": missing, "people": people, "captured_at": event["captured_at"]}
+
+    def encode_stage(self, event):
+        timings = {}
+        event["image_data"], event["image_hash"], event["content_type"] = encode_image(
+            event["annotated"], timings, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_SCALE, IMAGE_ZSTD
+        )
+        with timed(timings, "phash"):
+            event["perceptual_hash"] = dhash(event["annotated"])
+        record_timings(timings)
+        return event
+
+    def delivery_stage(self, event):
+        missing = event["missing"]
+        if "person" in missing:
+            CAPTURES.labels(self.name, "no_person").inc()
+            print(f"[{self.name}] No person detected. Skipping Telegram alert.")
+            return
+        # Someone lingering or re-triggering the sensor, the server folds the event into the earlier one
+        repeat = bool(REPEAT_WINDOW) and self.repeats.check(event["perceptual_hash"], missing, event["captured_at"])
+        if repeat:
+            REPEAT_CAPTURES.labels(self.name).inc()
+        if missing:
+            CAPTURES.labels(self.name, "flagged").inc()
+        else:
+            CAPTURES.labels(self.name, "clear").inc()
+            print(f"[{self.name}] All PPE present.")
+        if missing and repeat:
+            print(f"[{self.name}] Repeat of a recent violation, skipping Telegram alert.")
+        elif missing:
+            people = event["people"]
+            offenders = f" ({sum(1 for person in people if person['missing'])} of {len(people)} people)" if len(people) > 1 else ""
+            photo = None
+            if ALERT_ATTACH_IMAGE:
+                photo = zstd.decompress(event["image_data"]) if IMAGE_ZSTD else event["image_data"]
+            alerts.alert(
+                self.name,
+                f"PPE Missing at {self.name}: {', '.join(missing)}{offenders}. Image Evidence: https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{event['image_hash']}",
+                missing,
+                photo,
+                event["captured_at"]
+            )
+        upload_event(
+            event["image_data"], bool(missing), self.name, event["captured_at"], event["image_hash"], event["content_type"], IMAGE_ZSTD,
+            event["perceptual_hash"], repeat
+        )
+        print(f"[{self.name}] Event handed to outbox {time.time() - event['captured_at']:.2f}s after capture")
+
+    # --- Capture loop ---
+    def wait_for_person(self):
+        """ Block until someone is in range, returns False if the gate is stopping. """
+        print(f"[{self.name}] Waiting for person...")
+        while not self.trigger.wait_for_in_range(timeout=0.5):
+            if self.stopping.is_set():
+                return False
+        print(f"[{self.name}] Person detected!")
         return True
-    except Exception as e:
-        print(f"Error uploading event: {e}")
-        return False
-
-# Overlay function to show guide and countdown
-def show_guide(frame, elapsed):
-    h, w, _ = frame.shape
-    box_width, box_height = 200, 400
-    top_left = (w // 2 - box_width // 2, h // 2 - box_height // 2)
-    bottom_right = (w // 2 + box_width // 2, h // 2 + box_height // 2)
-    overlay = frame.copy()
-    cv2.rectangle(overlay, top_left, bottom_right, (0, 255, 0), 2)
-    countdown = max(0, int(5 - elapsed) + 1)
-    cv2.putText(overlay, "Stand Here", (top_left[0], top_left[1] - 10),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-    cv2.putText(overlay, f"Photo in: {countdown}s", (w - 250, 40),
-                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
-    return overlay, top_left, bottom_right
-
-def run_inference(frame, top_left, bottom_right):
-    h, w, _ = frame.shape
-    box_width = bottom_right[0] - top_left[0]
-    box_height = bottom_right[1] - top_left[1]
-
-    padding_x = int(box_width * 0.3)
-    padding_y = int(box_height * 0.3)
-    roi_x1 = max(0, top_left[0] - padding_x)
-    roi_y1 = max(0, top_left[1] - padding_y)
-    roi_x2 = min(w, bottom_right[0] + padding_x)
-    roi_y2 = min(h, bottom_right[1] + padding_y)
-
-    cropped_frame = frame[roi_y1:roi_y2, roi_x1:roi_x2]
-    resized_frame = cv2.resize(cropped_frame, (320, 320))
-
-    results = model(resized_frame)
-
-    # Copy the original cropped frame for annotation
-    annotated_crop = cropped_frame.copy()
-    detected_classes = set()
-
-    for box in results[0].boxes:
-        cls_id = int(box.cls[0].item())
-        class_name = model.names[cls_id]
-        detected_classes.add(class_name)
-
-        # Draw bounding boxes if enabled
-        if SHOW_BOUNDING_BOXES:
-            xyxy = box.xyxy[0].int().tolist()
-            x1, y1, x2, y2 = xyxy
-            cv2.rectangle(annotated_crop, (x1, y1), (x2, y2), (255, 255, 0), 2)
-            cv2.putText(annotated_crop, class_name, (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-
-    # Checklist overlay
-    checklist_x, checklist_y = 10, 30
-    for item in required_items:
-        color = (0, 255, 0) if item in detected_classes else (0, 0, 255)
-        cv2.putText(annotated_crop, item, (checklist_x, checklist_y),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-        checklist_y += 30
-
-    missing_items = [item for item in required_items if item not in detected_classes]
-    return annotated_crop, missing_items
 
-# --- Display function ---
-def show_result_window(img, timeout=5):
-    start = time.time()
-    while time.time() - start < timeout:
-        cv2.imshow("YOLO Detection", img)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    def run(self):
+        while not self.stopping.is_set() and (not SOAK_CAPTURES or self.captures < SOAK_CAPTURES):
+            if not self.wait_for_person():
+                break
 
-# --- Main loop ---
-try:
-    while True:
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-        print("Waiting for person...")
-        US.wait_for_in_range()
-        print("Person detected!")
-
-        # Countdown with guide
-        start_time = time.time()
-        while time.time() - start_time < 5:
-            ret, frame = cap.read()
-            if not ret:
+            # Countdown with guide, the burst is sampled at even intervals up to the deadline so a blink or
+            # a passing occlusion cannot cover every frame. The final frame is the last sample
+            start_time = time.time()
+            top_left = bottom_right = None
+            burst = []
+            sample_times = [COUNTDOWN_SECONDS - index * BURST_SPAN / BURST_FRAMES for index in range(BURST_FRAMES - 1, 0, -1)]
+            while time.time() - start_time < COUNTDOWN_SECONDS and not self.stopping.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    CAMERA_READ_FAILURES.inc()
+                    continue
+                elapsed = time.time() - start_time
+                if len(burst) < len(sample_times) and elapsed >= sample_times[len(burst)]:
+                    # Grabbed frames are reused buffers, keep a copy
+                    burst.append(frame.copy())
+                overlay, top_left, bottom_right = show_guide(frame, elapsed, COUNTDOWN_SECONDS)
+                if not HEADLESS:
+                    self.display = overlay
+
+            # Capture final frame and hand the burst over to the inference worker
+            ret, final_frame = self.cap.read()
+            if not ret or top_left is None or self.stopping.is_set():
                 continue
-            elapsed = time.time() - start_time
-            overlay, top_left, bottom_right = show_guide(frame, elapsed)
-            cv2.imshow("YOLO Detection", overlay)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            # Only run the full model if someone is still in the guide box
+            if self.presence_gate is not None and not self.presence_gate.occupied(final_frame, learn=False):
+                TRIGGERS_REJECTED.labels("left").inc()
+                print(f"[{self.name}] Guide box is empty, skipping inference.")
+                continue
+            burst.append(final_frame.copy())
+            burst_size = self.inference_latency.items_within(BURST_LATENCY_BUDGET, BURST_FRAMES)
+            self.pipeline.submit({
+                "frames": list(burst)[-burst_size:],
+                "top_left": top_left,
+                "bottom_right": bottom_right,
+                "captured_at": time.time()
+            })
+            self.throughput.mark()
+            self.captures += 1
+            print(f"[{self.name}] Gate throughput: {self.throughput.per_minute():.1f} people/min")
 
-        # Capture final frame and run inference
-        ret, final_frame = cap.read()
-        if not ret:
-            continue
+            # The result is shown as it arrives, doubles as the cooldown before re-arming
+            self.stopping.wait(COOLDOWN_SECONDS)
 
-        annotated, missing = run_inference(final_frame, top_left, bottom_right)
-        show_result_window(annotated, timeout=5)  # Show detection result
+    def close(self):
+        self.pipeline.stop(timeout=30)
+        print(f"[{self.name}] Pipeline stats: {self.pipeline.stats()}")
+        print(f"[{self.name}] Captures: {self.captures}, throughput: {self.throughput.per_minute():.1f} people/min")
+        if self.cap is not None:
+            self.cap.release()
+        if self.trigger is not None:
+            self.trigger.close()
 
-        _, buffer = cv2.imencode('.png', annotated)
-        image_data = base64.b64encode(zstd.compress(buffer)).decode("utf-8")
+# --- Display function ---
+# OpenCV windows must be driven from the main thread. Shows the newest frame of every gate in its own window
+# until 'q' is pressed or every gate has stopped.
+def show_windows(gates):
+    shown = {}
+    while any(gate.thread.is_alive() for gate in gates):
+        if HEADLESS:
+            time.sleep(0.5)
+            continue
+        for gate in gates:
+            frame = gate.display
+            if frame is not None and frame is not shown.get(gate.name):
+                cv2.imshow(gate.name, frame)
+                shown[gate.name] = frame
+        if cv2.waitKey(30) & 0xFF == ord('q'):
+            return
 
-        if "person" in missing:
-            print("No person detected. Skipping Telegram alert.")
-        elif missing:
-            image_hash = hashlib.sha256(buffer).hexdigest()
-            telegram_message(f"PPE Missing at {device_name}: {', '.join(missing)}. Image Evidence: https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{image_hash}")
-            upload_event(image_data, True, device_name)
-        else:
-            print("All PPE present.")
-            upload_event(image_data, False, device_name)
+# --- Main loop ---
+def main():
+    startup_timings = {"imports": time.perf_counter() - STARTED_AT}
+    gate_configs = load_gate_configs()
+    stopping = threading.Event()
 
-        time.sleep(5)  # Cooldown
-        cv2.destroyAllWindows()
+    with timed(startup_timings, "model_load"):
+        model = load_model(MODEL_CHECKPOINT, INFERENCE_BACKEND, MODEL_INPUT_SIZE)
+    scheduler = InferenceScheduler(model, SCHEDULER_MAX_BATCH, SCHEDULER_MAX_WAIT)
+    gates = [Gate(gate_config, scheduler.for_gate(gate_config["device_name"]), stopping) for gate_config in gate_configs]
+    with timed(startup_timings, "camera"):
+        for gate in gates:
+            gate.open_camera()
+    # The first calls pay for graph compilation and allocations, get them out of the way before anyone is waiting.
+    # Only single images and the largest batch the scheduler can form are warmed, every size in between would add
+    # two full-size forwards each to startup.
+    with timed(startup_timings, "warm_up"):
+        max_batch = max(BURST_FRAMES, min(SCHEDULER_MAX_BATCH, BURST_FRAMES * len(gates)))
+        per_image = model.warm_up(batch_sizes=(1, max_batch))
+        for gate in gates:
+            gate.inference_latency.add(per_image)
+    with timed(startup_timings, "workers"):
+        outbox.start()
+        alerts.start()
+        scheduler.start()
+        for gate in gates:
+            gate.pipeline.start()
+        if METRICS_PORT:
+            start_exporter(METRICS_PORT, {gate.name: gate.pipeline for gate in gates}, outbox)
+    with timed(startup_timings, "sensor"):
+        for gate in gates:
+            gate.open_trigger()
+    breakdown = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in startup_timings.items())
+    print(f"{len(gates)} gate(s) armed {time.perf_counter() - STARTED_AT:.2f}s after start ({breakdown})")
+
+    try:
+        for gate in gates:
+            gate.thread.start()
+        show_windows(gates)
+    finally:
+        print("Cleaning up...")
+        stopping.set()
+        for gate in gates:
+            gate.thread.join(timeout=COUNTDOWN_SECONDS + 5)
+        for gate in gates:
+            gate.close()
+        scheduler.stop(timeout=10)
+        print(f"Shared model ran {scheduler.batches} batches")
+        alerts.stop(timeout=10)
+        outbox.stop(timeout=10)
+        print(f"Outbox pending: {outbox.pending()}")
+        # Linux reports the peak resident set size in kilobytes
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Captures: {sum(gate.captures for gate in gates)}, peak RSS: {peak_rss_mb:.0f} MB")
+        if not HEADLESS:
+            cv2.destroyAllWindows()
 
-finally:
-    print("Cleaning up...")
-    cap.release()
-    cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()